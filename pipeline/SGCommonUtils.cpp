@@ -65,6 +65,55 @@ size_t usBetween(const std::chrono::steady_clock::time_point &start,
 TimeRecorder::~TimeRecorder(){
 }
 
+size_t LatencyHistogram::bucketIndex(size_t us)
+{
+    if(us >= ((size_t)1<<32)) us = ((size_t)1<<32) - 1;
+    if(us < SUB_BUCKETS) return us;
+    size_t e = 0;
+    while((us >> e) >= 2*SUB_BUCKETS) e++;
+    return (e+1)*SUB_BUCKETS + (us>>e) - SUB_BUCKETS;
+}
+
+size_t LatencyHistogram::bucketUpper(size_t index)
+{
+    if(index < SUB_BUCKETS) return index;
+    size_t e = index/SUB_BUCKETS - 1;
+    size_t sub = index%SUB_BUCKETS + SUB_BUCKETS;
+    return ((sub+1)<<e) - 1;
+}
+
+void LatencyHistogram::record(size_t us)
+{
+    buckets[bucketIndex(us)]++;
+    total++;
+    sum += us;
+    if(us < minValue) minValue = us;
+    if(us > maxValue) maxValue = us;
+}
+
+void LatencyHistogram::reset()
+{
+    std::fill(buckets, buckets+BUCKETS, 0);
+    total = 0;
+    sum = 0;
+    minValue = (size_t)-1;
+    maxValue = 0;
+}
+
+size_t LatencyHistogram::percentile(double p) const
+{
+    if(total == 0) return 0;
+    uint64_t rank = (uint64_t)(p/100.0*total + 0.5);
+    if(rank < 1) rank = 1;
+    if(rank > total) rank = total;
+    uint64_t acc = 0;
+    for(size_t i=0; i<BUCKETS; i++){
+        acc += buckets[i];
+        if(acc >= rank) return std::min(bucketUpper(i), maxValue);
+    }
+    return maxValue;
+}
+
 std::size_t strReplaceAll(std::string &inout, const std::string &what, const std::string &with)
 {
     std::size_t count{};
@@ -9,6 +9,7 @@
 #include <vector>
 #include <algorithm>
 #include <functional>
+#include <cstdint>
 
 namespace bm {
 
@@ -26,6 +27,34 @@ using TimerClock = std::chrono::steady_clock;
 size_t usBetween(const std::chrono::steady_clock::time_point &start,
         const std::chrono::steady_clock::time_point &stop);
 
+// Fixed memory log-bucket histogram of microsecond latencies.
+// Each power of 2 is split into SUB_BUCKETS linear buckets, relative error < 1/SUB_BUCKETS.
+class LatencyHistogram {
+public:
+    static const size_t SUB_BITS = 4;
+    static const size_t SUB_BUCKETS = 1 << SUB_BITS;
+    static const size_t BUCKETS = (32 - SUB_BITS + 1) * SUB_BUCKETS;
+
+    LatencyHistogram() { reset(); }
+    void record(size_t us);
+    void reset();
+    // Upper bound of the bucket holding the p-th percentile, p in [0, 100]
+    size_t percentile(double p) const;
+    size_t count() const { return total; }
+    double mean() const { return total? (double)sum/total: 0; }
+    size_t min() const { return total? minValue: 0; }
+    size_t max() const { return maxValue; }
+
+private:
+    static size_t bucketIndex(size_t us);
+    static size_t bucketUpper(size_t index);
+    uint64_t buckets[BUCKETS];
+    uint64_t total;
+    uint64_t sum;
+    size_t minValue;
+    size_t maxValue;
+};
+
 class TimeRecorder{
 private:
     std::chrono::steady_clock::time_point start;
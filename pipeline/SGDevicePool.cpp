@@ -66,23 +66,48 @@ SGDeviceContext::~SGDeviceContext() {
 
 void ProcessStatInfo::update(const std::shared_ptr<ProcessStatus> &status, size_t batch) {
     if(status->valid){
+        std::lock_guard<std::mutex> guard(mutex);
         numSamples += batch;
+        windowSamples += batch;
         totalDuration += status->totalDuration();
         for(size_t i = durations.size(); i<status->starts.size(); i++){
             durations.push_back(0);
         }
+        if(histograms.empty()){
+            histograms.resize(status->starts.size() + 1);
+        }
         for(size_t i=0; i<status->starts.size(); i++){
-            durations[i] += usBetween(status->starts[i], status->ends[i]);
+            auto us = usBetween(status->starts[i], status->ends[i]);
+            durations[i] += us;
+            if(i + 1 < histograms.size()) histograms[i].record(us);
         }
+        histograms.back().record(status->totalDuration());
         deviceProcessNum[status->deviceId] += batch;
     }
 }
 
 void ProcessStatInfo::start() {
+    std::lock_guard<std::mutex> guard(mutex);
     startTime=std::chrono::steady_clock::now();
+    windowStart = startTime;
+}
+
+double ProcessStatInfo::get_latency(std::vector<LatencyHistogram> &out, bool reset) {
+    std::lock_guard<std::mutex> guard(mutex);
+    auto now = std::chrono::steady_clock::now();
+    auto us = usBetween(windowStart, now);
+    double qps = us? windowSamples*1e6/us: 0;
+    out = histograms;
+    if(reset){
+        for(auto& h: histograms) h.reset();
+        windowSamples = 0;
+        windowStart = now;
+    }
+    return qps;
 }
 
 uint32_t *ProcessStatInfo::get_durations(unsigned *num) {
+    std::lock_guard<std::mutex> guard(mutex);
     *num = durations.size();
     auto data = new uint32_t[durations.size()];
     std::copy(durations.begin(), durations.end(), data);
@@ -90,6 +115,7 @@ uint32_t *ProcessStatInfo::get_durations(unsigned *num) {
 }
 
 void ProcessStatInfo::show() {
+    std::lock_guard<std::mutex> guard(mutex);
     auto end = std::chrono::steady_clock::now();
     auto totalUs = usBetween(startTime, end);
     SGLOG(INFO, "For model '%s'", name.c_str());
@@ -5,6 +5,7 @@
 #include <algorithm>
 #include <exception>
 #include <chrono>
+#include <mutex>
 #include "SGDeviceUtils.h"
 #include "SGPipelinePool.h"
 #include "SGNetwork.h"
@@ -79,11 +80,20 @@ struct ProcessStatInfo {
     size_t numSamples = 0;
     std::map<size_t, size_t> deviceProcessNum;
     std::vector<size_t> durations;
+    // Per phase latency histograms, the last one is the whole process
+    std::vector<LatencyHistogram> histograms;
+    size_t windowSamples = 0;
+    std::chrono::steady_clock::time_point windowStart;
+    std::mutex mutex;
     std::string name;
     std::chrono::steady_clock::time_point startTime;
-    ProcessStatInfo(const std::string& name): name(name), startTime(std::chrono::steady_clock::now()){ }
+    ProcessStatInfo(const std::string& name):
+        windowStart(std::chrono::steady_clock::now()), name(name), startTime(windowStart){ }
     void update(const std::shared_ptr<ProcessStatus>& status, size_t batch=1);
     uint32_t *get_durations(unsigned *num);
+    // Copy histograms of current window, samples/sec of the window is returned.
+    // If reset is set, a new window is started.
+    double get_latency(std::vector<LatencyHistogram>& out, bool reset);
     void show();
     void start();
     ~ProcessStatInfo(){
@@ -1,5 +1,6 @@
 #include <map>
 #include <memory>
+#include <mutex>
 #include <string.h>
 #include "bmruntime_interface.h"
 #include "SGDevicePool.h"
@@ -66,8 +67,18 @@ struct RunnerInfo {
     unsigned int batch;
 };
 
+// Guards globalRunnerInfos, which is used from caller and result reader threads.
+// Look runners up by getRunnerInfo and use them after the lock is released.
+std::mutex globalRunnerMutex;
 std::map<unsigned int, std::shared_ptr<RunnerInfo>> globalRunnerInfos;
 
+static std::shared_ptr<RunnerInfo> getRunnerInfo(unsigned int runner_id) {
+    std::lock_guard<std::mutex> lock(globalRunnerMutex);
+    auto it = globalRunnerInfos.find(runner_id);
+    if(it == globalRunnerInfos.end()) return nullptr;
+    return it->second;
+}
+
 bool preProcess(const InputType& input, const TensorVec& inTensors, ContextPtr ctx){
     if(input.num == 0){
         return false;
@@ -114,9 +125,11 @@ bool postProcess(const InputType& input, const TensorVec& outTensors, OutputType
 
 unsigned int runner_start_with_batch(const char *bmodel, unsigned int batch) {
     set_env_log_level();
+    auto info = std::make_shared<RunnerInfo>(bmodel, batch);
+    std::lock_guard<std::mutex> lock(globalRunnerMutex);
     unsigned int runner_id = 0;
     while(globalRunnerInfos.count(runner_id)) runner_id++;
-    globalRunnerInfos[runner_id] = std::make_shared<RunnerInfo>(bmodel, batch);
+    globalRunnerInfos[runner_id] = info;
     return runner_id;
 }
 
@@ -126,22 +139,31 @@ unsigned int runner_start(const char *bmodel) {
 }
 
 void runner_stop(unsigned int runner_id) {
-    if(!globalRunnerInfos.count(runner_id)) return;
-    globalRunnerInfos[runner_id]->runner.join();
-    globalRunnerInfos.erase(runner_id);
+    std::shared_ptr<RunnerInfo> info;
+    {
+        std::lock_guard<std::mutex> lock(globalRunnerMutex);
+        auto it = globalRunnerInfos.find(runner_id);
+        if(it == globalRunnerInfos.end()) return;
+        info = it->second;
+        globalRunnerInfos.erase(it);
+    }
+    // Readers still waiting hold their own reference
+    info->runner.join();
 }
 
 void runner_show_status(unsigned int runner_id)
 {
-    if(!globalRunnerInfos.count(runner_id)) return;
-    globalRunnerInfos[runner_id]->status.show();
+    auto info = getRunnerInfo(runner_id);
+    if(!info) return;
+    info->status.show();
 }
 
 unsigned int runner_put_input(unsigned runner_id, unsigned int input_num, const tensor_data_t *input_tensors, int need_copy)
 {
-    if(!globalRunnerInfos.count(runner_id)) return -1;
+    auto info = getRunnerInfo(runner_id);
+    if(!info) return -1;
     InputType input;
-    input.id = globalRunnerInfos[runner_id]->nextId();
+    input.id = info->nextId();
     input.release_inside = need_copy;
     input.num = input_num;
     if(input_num != 0){
@@ -159,19 +181,21 @@ unsigned int runner_put_input(unsigned runner_id, unsigned int input_num, const
     } else {
         input.tensors = nullptr;
     }
-    globalRunnerInfos[runner_id]->runner.push(input);
+    info->runner.push(input);
     return input.id;
 }
 
 
 int runner_all_stopped(size_t runner_id){
-    if(!globalRunnerInfos.count(runner_id)) return true;
-    return globalRunnerInfos[runner_id]->runner.allStopped();
+    auto info = getRunnerInfo(runner_id);
+    if(!info) return true;
+    return info->runner.allStopped();
 }
 
 static tensor_data_t *__runner_get_output(unsigned runner_id, unsigned int *task_id, unsigned int *output_num, unsigned int *is_valid, bool is_async){
-    if(!globalRunnerInfos.count(runner_id)) return nullptr;
-    auto& info = globalRunnerInfos[runner_id];
+    // Hold a reference, runner may be stopped while we are waiting
+    auto info = getRunnerInfo(runner_id);
+    if(!info) return nullptr;
     OutputType output;
     std::shared_ptr<ProcessStatus> status;
     bool ok;
@@ -200,6 +224,29 @@ tensor_data_t *runner_get_output(unsigned runner_id, unsigned int *task_id, unsi
     return __runner_get_output(runner_id, task_id, output_num, is_valid, false);
 }
 
+unsigned int runner_put_inputs(unsigned runner_id, unsigned int task_num, unsigned int input_num,
+                               const tensor_data_t *input_tensors, int need_copy, unsigned int *task_ids)
+{
+    for(size_t i=0; i<task_num; i++){
+        task_ids[i] = runner_put_input(runner_id, input_num, input_tensors + i*input_num, need_copy);
+    }
+    return task_num;
+}
+
+unsigned int runner_get_outputs(unsigned runner_id, unsigned int max_num, int wait,
+                                unsigned int *task_ids, unsigned int *output_nums, unsigned int *is_valids,
+                                tensor_data_t **outputs)
+{
+    unsigned int num = 0;
+    for(; num<max_num; num++){
+        task_ids[num] = INVALID_TASK_ID;
+        bool is_async = num>0 || !wait;
+        outputs[num] = __runner_get_output(runner_id, &task_ids[num], &output_nums[num], &is_valids[num], is_async);
+        if(task_ids[num] == INVALID_TASK_ID) break;
+    }
+    return num;
+}
+
 unsigned int runner_release_output(unsigned int output_num, const tensor_data_t *output_data){
     for(size_t i=0; i<output_num; i++){
         delete [] output_data[i].data;
@@ -210,17 +257,18 @@ unsigned int runner_release_output(unsigned int output_num, const tensor_data_t
 
 int runner_empty(unsigned int runner_id)
 {
-    if(!globalRunnerInfos.count(runner_id)) return true;
-    return globalRunnerInfos[runner_id]->runner.empty();
+    auto info = getRunnerInfo(runner_id);
+    if(!info) return true;
+    return info->runner.empty();
 }
 
 void runner_join(unsigned int runner_id)
 {
-    if(!globalRunnerInfos.count(runner_id)) {
+    auto info = getRunnerInfo(runner_id);
+    if(!info) {
         SGLOG(ERROR, "invalid runner_id %d", runner_id);
         return;
     }
-    auto& info = globalRunnerInfos[runner_id];
     info->runner.join();
 }
 
@@ -241,11 +289,11 @@ unsigned int available_devices(unsigned int *devices, unsigned int maxNum)
 
 blob_info_t *get_input_info(unsigned runner_id, unsigned *num)
 {
-    if(!globalRunnerInfos.count(runner_id)) {
+    auto info = getRunnerInfo(runner_id);
+    if(!info) {
         SGLOG(ERROR, "invalid runner_id %d", runner_id);
         return nullptr;
     }
-    auto& info = globalRunnerInfos[runner_id];
     const bm_net_info_t *net_info = info->runner.getNetInfo();
     *num = net_info->input_num;
     auto blobs = new blob_info_t[*num];
@@ -264,11 +312,11 @@ blob_info_t *get_input_info(unsigned runner_id, unsigned *num)
 
 blob_info_t *get_output_info(unsigned runner_id, unsigned *num)
 {
-    if(!globalRunnerInfos.count(runner_id)) {
+    auto info = getRunnerInfo(runner_id);
+    if(!info) {
         SGLOG(ERROR, "invalid runner_id %d", runner_id);
         return nullptr;
     }
-    auto& info = globalRunnerInfos[runner_id];
     const bm_net_info_t *net_info = info->runner.getNetInfo();
     *num = net_info->output_num;
     auto blobs = new blob_info_t[*num];
@@ -293,8 +341,34 @@ void release_input_info(unsigned runner_id, blob_info_t *info)
 uint32_t *get_runner_durations(unsigned runner_id, unsigned *num)
 {
     *num = 0;
-    if(!globalRunnerInfos.count(runner_id)) return nullptr;
-    return globalRunnerInfos[runner_id]->status.get_durations(num);
+    auto info = getRunnerInfo(runner_id);
+    if(!info) return nullptr;
+    return info->status.get_durations(num);
+}
+
+unsigned int get_runner_latency_stats(unsigned runner_id, latency_stats_t *stats, unsigned int max_num,
+                                      double *qps, int reset)
+{
+    *qps = 0;
+    auto info = getRunnerInfo(runner_id);
+    if(!info) return 0;
+    std::vector<LatencyHistogram> histograms;
+    *qps = info->status.get_latency(histograms, reset);
+    unsigned int num = 0;
+    for(; num<max_num && num<histograms.size(); num++){
+        auto& h = histograms[num];
+        auto& s = stats[num];
+        s.name = num + 1 == histograms.size()? "TOTAL": __phaseMap[num];
+        s.count = h.count();
+        s.mean = h.mean();
+        s.min = h.min();
+        s.max = h.max();
+        s.p50 = h.percentile(50);
+        s.p90 = h.percentile(90);
+        s.p99 = h.percentile(99);
+        s.p999 = h.percentile(99.9);
+    }
+    return num;
 }
 
 void release_unsigned_pointer(unsigned *data)
@@ -38,6 +38,16 @@ tensor_data_t *runner_get_output(unsigned runner_id, unsigned int *task_id, unsi
 tensor_data_t *runner_try_to_get_output(unsigned runner_id, unsigned int *task_id, unsigned int *output_num, unsigned int *is_valid);
 unsigned int runner_release_output(unsigned int output_num, const tensor_data_t *output_data);
 
+/* Bulk versions, amortize the per call overhead for small models.
+ * input_tensors holds task_num*input_num tensors, task_ids receives task_num ids.
+ * runner_get_outputs fetches up to max_num outputs, blocking for the first one if wait is set,
+ * and returns the number fetched. */
+unsigned int runner_put_inputs(unsigned runner_id, unsigned int task_num, unsigned int input_num,
+                               const tensor_data_t* input_tensors, int need_copy, unsigned int *task_ids);
+unsigned int runner_get_outputs(unsigned runner_id, unsigned int max_num, int wait,
+                                unsigned int *task_ids, unsigned int *output_nums, unsigned int *is_valids,
+                                tensor_data_t **outputs);
+
 struct blob_info_t {
     const char *name;
     int num_dims;
@@ -51,6 +61,24 @@ blob_info_t *get_output_info(unsigned runner_id, unsigned *num);
 void release_input_info(unsigned runner_id, blob_info_t *);
 void runner_join(unsigned int runner_id);
 unsigned *get_runner_durations(unsigned runner_id, unsigned *num);
+
+/* Latency in microseconds of one pipeline stage, "TOTAL" is the whole process */
+struct latency_stats_t {
+    const char *name;
+    unsigned long long count;
+    double mean;
+    unsigned int min;
+    unsigned int max;
+    unsigned int p50;
+    unsigned int p90;
+    unsigned int p99;
+    unsigned int p999;
+};
+
+/* Fill up to max_num stages, return the number of stages filled.
+ * qps is samples/sec since runner start or the last reset. */
+unsigned int get_runner_latency_stats(unsigned runner_id, latency_stats_t *stats, unsigned int max_num,
+                                      double *qps, int reset);
 void release_unsigned_pointer(unsigned *data);
 
 #ifdef __cplusplus
@@ -1,9 +1,10 @@
 import os
 import pytest
-from utils import change_dir
 
 @pytest.fixture(scope='session')
 def setup_session(pytestconfig, request):
+    # Model zoo helpers need prettytable, which the unit tests do not
+    from utils import change_dir
     cwd = os.getcwd()
     change_dir(os.environ.get('MODEL_ZOO_PATH'))
     task = pytestconfig.getoption('-m')
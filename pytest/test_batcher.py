@@ -0,0 +1,86 @@
+import time
+import numpy as np
+import pytest
+from concurrent.futures import Future
+from tpu_perf.batcher import SGBatcher
+
+class FakeRunner:
+    """
+    Static batch runner which pads short batches like the native runner,
+    and doubles the input.
+    """
+    def __init__(self, batch=4):
+        self.batch = batch
+        self.submitted = []
+
+    def get_input_info(self):
+        return dict(data=dict(shape=[self.batch, 3], dtype=0, scale=1))
+
+    def submit(self, data):
+        self.submitted.append(data.copy())
+        padded = np.zeros((self.batch, ) + data.shape[1:], dtype=data.dtype)
+        padded[:len(data)] = data
+        future = Future()
+        future.set_result(([padded * 2], True))
+        return future
+
+def request(value, num=1):
+    return np.full((num, 3), value, dtype=np.float32)
+
+def test_full_batch_flush():
+    runner = FakeRunner()
+    with SGBatcher(runner, max_wait=10) as batcher:
+        assert batcher.max_batch == 4
+        futures = [batcher.submit(request(i)) for i in range(4)]
+        # Sent as soon as full, long before max_wait
+        outputs = [f.result(timeout=1) for f in futures]
+    assert [len(b) for b in runner.submitted] == [4]
+    for i, (out, valid) in enumerate(outputs):
+        assert valid
+        np.testing.assert_array_equal(out[0], request(i * 2))
+
+def test_max_wait_flush_pads_short_batch():
+    runner = FakeRunner()
+    with SGBatcher(runner, max_wait=0.05) as batcher:
+        start = time.monotonic()
+        futures = [batcher.submit(request(1)), batcher.submit(request(2, num=2))]
+        outputs = [f.result(timeout=1) for f in futures]
+        assert time.monotonic() - start >= 0.04
+    # Short batch of 3 is sent as is and padded by the runner
+    assert [len(b) for b in runner.submitted] == [3]
+    np.testing.assert_array_equal(outputs[0][0][0], request(2))
+    np.testing.assert_array_equal(outputs[1][0][0], request(4, num=2))
+    assert batcher.mean_batch() == 3
+
+def test_split_per_request():
+    runner = FakeRunner()
+    with SGBatcher(runner, max_wait=0.05) as batcher:
+        # The third request does not fit and starts the next batch
+        futures = [batcher.submit(request(i, num=n)) for i, n in enumerate([2, 1, 2])]
+        outputs = [f.result(timeout=1)[0][0] for f in futures]
+    assert [len(b) for b in runner.submitted] == [3, 2]
+    assert [len(o) for o in outputs] == [2, 1, 2]
+    for i, out in enumerate(outputs):
+        assert (out == i * 2).all()
+    with pytest.raises(ValueError):
+        batcher.submit(request(0, num=5))
+
+def test_submit_after_close():
+    runner = FakeRunner()
+    batcher = SGBatcher(runner, max_wait=10)
+    future = batcher.submit(request(1))
+    batcher.close()
+    # Queued requests are dispatched on close
+    np.testing.assert_array_equal(future.result(timeout=1)[0][0], request(2))
+    with pytest.raises(RuntimeError):
+        batcher.submit(request(1))
+    batcher.close()
+
+def test_runner_error_fails_requests():
+    class FailingRunner(FakeRunner):
+        def submit(self, data):
+            raise RuntimeError('put failed')
+    with SGBatcher(FailingRunner(), max_wait=0.01) as batcher:
+        future = batcher.submit(request(1))
+        with pytest.raises(RuntimeError):
+            future.result(timeout=1)
@@ -0,0 +1,399 @@
+import os
+import gc
+import time
+import asyncio
+import threading
+import ctypes as ct
+from collections import deque
+import numpy as np
+import pytest
+from tpu_perf import infer
+
+class FakeLib:
+    """
+    Stand-in for libpipeline.so driving SGInfer through its ctypes calls.
+    Outputs are the inputs doubled, and are ready in put order unless
+    auto is off, in which case the test completes tasks in any order.
+    Task ids start at 0 like the native runner.
+    """
+    def __init__(self):
+        self.auto = True
+        self.cond = threading.Condition()
+        self.running = set()
+        self.next_runner = 0
+        self.task_id = infer.INVALID_TASK_ID
+        self.inputs = dict()
+        self.ready = deque()
+        self.outputs = dict()
+        self.released = []
+
+    def runner_start_with_batch(self, path, batch):
+        with self.cond:
+            runner_id = self.next_runner
+            self.next_runner += 1
+            self.running.add(runner_id)
+            return runner_id
+
+    def runner_use_devices(self, devices, num):
+        pass
+
+    def runner_stop(self, runner_id):
+        with self.cond:
+            self.running.discard(runner_id)
+            self.cond.notify_all()
+
+    def runner_join(self, runner_id):
+        pass
+
+    def runner_empty(self, runner_id):
+        with self.cond:
+            return not self.ready
+
+    def runner_all_stopped(self, runner_id):
+        return runner_id not in self.running
+
+    def runner_put_input(self, runner_id, input_num, inputs, need_copy):
+        with self.cond:
+            if runner_id not in self.running:
+                return infer.INVALID_TASK_ID
+            self.task_id = (self.task_id + 1) & 0xFFFFFFFF
+            task_id = self.task_id
+            self.inputs[task_id] = [inputs[i].to_numpy() for i in range(input_num)]
+            if self.auto:
+                self.ready.append((task_id, True))
+                self.cond.notify_all()
+            return task_id
+
+    def runner_put_inputs(self, runner_id, task_num, input_num, inputs, need_copy, task_ids):
+        for i in range(task_num):
+            task_ids[i] = self.runner_put_input(
+                runner_id, input_num, inputs[i * input_num:(i + 1) * input_num], need_copy)
+        return task_num
+
+    def complete(self, task_id, valid=True):
+        with self.cond:
+            self.ready.append((task_id, valid))
+            self.cond.notify_all()
+
+    def __pop(self, runner_id, wait):
+        if wait:
+            self.cond.wait_for(lambda: self.ready or runner_id not in self.running)
+        if not self.ready:
+            return None
+        task_id, valid = self.ready.popleft()
+        arrays = [x * 2 for x in self.inputs.pop(task_id)]
+        tensors = (infer.SGTensor * len(arrays))()
+        for tensor, arr in zip(tensors, arrays):
+            tensor.from_numpy(arr)
+        self.outputs[ct.addressof(tensors)] = (tensors, arrays)
+        self.cond.notify_all()
+        return task_id, len(arrays), valid, ct.cast(tensors, ct.POINTER(infer.SGTensor))
+
+    def runner_get_outputs(self, runner_id, max_num, wait, task_ids, output_nums, valids, outputs):
+        with self.cond:
+            num = 0
+            while num < max_num:
+                output = self.__pop(runner_id, wait and num == 0)
+                if output is None:
+                    break
+                task_ids[num], output_nums[num], valids[num], outputs[num] = output
+                num += 1
+            return num
+
+    def __get_output(self, runner_id, task_id, output_num, valid, wait):
+        with self.cond:
+            output = self.__pop(runner_id, wait)
+            if output is None:
+                return None
+            task_id._obj.value, output_num._obj.value, valid._obj.value, tensors = output
+            return tensors
+
+    def runner_get_output(self, runner_id, task_id, output_num, valid):
+        return self.__get_output(runner_id, task_id, output_num, valid, True)
+
+    def runner_try_to_get_output(self, runner_id, task_id, output_num, valid):
+        return self.__get_output(runner_id, task_id, output_num, valid, False)
+
+    def get_runner_latency_stats(self, runner_id, stats, max_num, qps, reset):
+        stats[0].name = b'infer'
+        stats[0].count = 4
+        stats[0].mean = 2500
+        stats[0].min, stats[0].max = 1000, 4000
+        stats[0].p50, stats[0].p90, stats[0].p99, stats[0].p999 = 2000, 3000, 4000, 4000
+        qps._obj.value = 400
+        self.stats_reset = reset
+        return 1
+
+    def runner_release_output(self, output_num, tensors):
+        address = ct.addressof(tensors.contents)
+        with self.cond:
+            del self.outputs[address]
+            self.released.append(address)
+
+@pytest.fixture
+def lib(monkeypatch):
+    lib = FakeLib()
+    monkeypatch.setattr(infer.SGInfer, '_SGInfer__lib', lib)
+    yield lib
+    for runner_id in list(lib.running):
+        lib.runner_stop(runner_id)
+
+def sample(value, shape=(1, 3)):
+    return np.full(shape, value, dtype=np.float32)
+
+def first(outputs):
+    return outputs[0][0, 0]
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+# ********************** bulk put/get **********************
+
+def test_first_task_id_is_routed(lib):
+    runner = infer.SGInfer('fake.bmodel')
+    outputs, valid = runner.submit(sample(1)).result(timeout=5)
+    assert valid and first(outputs) == 2
+    assert not lib.outputs
+
+def test_submit_many(lib):
+    runner = infer.SGInfer('fake.bmodel')
+    futures = runner.submit_many([[sample(i)] for i in range(5)])
+    assert [first(f.result(timeout=5)[0]) for f in futures] == [0, 2, 4, 6, 8]
+    with pytest.raises(ValueError):
+        runner.submit_many([[sample(0)], [sample(0), sample(0)]])
+    assert runner.submit_many([]) == []
+
+def test_put_many_get_many(lib):
+    runner = infer.SGInfer('fake.bmodel')
+    task_ids = runner.put_many([[sample(i)] for i in range(3)])
+    assert task_ids == [0, 1, 2]
+    results = runner.get_many(8)
+    assert [(task_id, first(outputs), valid) for task_id, outputs, valid in results] == \
+        [(0, 0, True), (1, 2, True), (2, 4, True)]
+    assert runner.get_many(8, wait=False) == []
+    assert not lib.outputs
+
+# ********************** zero copy **********************
+
+def test_zero_copy_release(lib):
+    runner = infer.SGInfer('fake.bmodel', zero_copy=True)
+    future = runner.submit(sample(1), sample(2))
+    outputs, valid = future.result(timeout=5)
+    # Views of the native output buffers
+    (tensors, arrays), = lib.outputs.values()
+    assert [o.ctypes.data for o in outputs] == [a.ctypes.data for a in arrays]
+    assert [first([o]) for o in outputs] == [2, 4]
+    del future
+    view = outputs[1]
+    del outputs
+    gc.collect()
+    assert not lib.released
+    # Released once the last view is gone
+    assert first([view]) == 4
+    del view
+    gc.collect()
+    assert lib.released == [ct.addressof(tensors)] and not lib.outputs
+
+def test_zero_copy_get_many(lib):
+    runner = infer.SGInfer('fake.bmodel', zero_copy=True)
+    runner.put_many([[sample(i)] for i in range(2)])
+    results = runner.get_many(8)
+    assert [first(outputs) for _, outputs, _ in results] == [0, 2]
+    assert not lib.released
+    del results
+    gc.collect()
+    assert len(lib.released) == 2 and not lib.outputs
+
+# ********************** dispatcher **********************
+
+def test_dispatch_out_of_order(lib):
+    lib.auto = False
+    runner = infer.SGInfer('fake.bmodel')
+    futures = [runner.submit(sample(i)) for i in range(4)]
+    for task_id in [2, 0, 3]:
+        lib.complete(task_id)
+        outputs, valid = futures[task_id].result(timeout=5)
+        assert valid and first(outputs) == task_id * 2
+    assert not futures[1].done()
+    assert list(runner.dispatcher.callbacks) == [1]
+    lib.complete(1)
+    assert first(futures[1].result(timeout=5)[0]) == 2
+    assert not runner.dispatcher.callbacks and not runner.dispatcher.early
+
+def test_dispatch_output_before_watch(lib):
+    runner = infer.SGInfer('fake.bmodel')
+    # Start the reader thread, then put without watching
+    runner.submit(sample(0)).result(timeout=5)
+    task_id = runner.put(sample(3))
+    wait_until(lambda: task_id in runner.dispatcher.early)
+    results = []
+    runner.dispatcher.watch(task_id, lambda *args: results.append(args))
+    # Delivered on the calling thread
+    assert len(results) == 1
+    outputs, valid, error = results[0]
+    assert valid and error is None and first(outputs) == 6
+    assert not runner.dispatcher.early
+
+def test_dispatch_invalid_output_released(lib):
+    lib.auto = False
+    runner = infer.SGInfer('fake.bmodel')
+    future = runner.submit(sample(1))
+    lib.complete(0, valid=False)
+    assert future.result(timeout=5) == ([], False)
+    assert len(lib.released) == 1 and not lib.outputs
+
+def test_dispatch_raw_put_mixed_with_submit(lib):
+    runner = infer.SGInfer('fake.bmodel')
+    before = runner.submit(sample(1))
+    task_id = runner.put(sample(2))
+    after = runner.submit(sample(3))
+    assert first(before.result(timeout=5)[0]) == 2
+    assert first(after.result(timeout=5)[0]) == 6
+    # The raw output is consumed by the dispatcher and kept for watch
+    wait_until(lambda: task_id in runner.dispatcher.early)
+    outputs, valid = runner.dispatcher.early[task_id]
+    assert valid and first(outputs) == 4
+    assert not runner.dispatcher.callbacks
+
+def test_dispatch_runner_stop_fails_pending(lib):
+    lib.auto = False
+    runner = infer.SGInfer('fake.bmodel')
+    future = runner.submit(sample(1))
+    lib.runner_stop(runner.runner_id)
+    with pytest.raises(RuntimeError):
+        future.result(timeout=5)
+    runner.dispatcher.thread.join(timeout=5)
+    assert runner.dispatcher.stopped
+
+# ********************** infer_iter **********************
+
+def complete_when_put(lib, num, task_id):
+    def run():
+        wait_until(lambda: len(lib.inputs) >= num)
+        lib.complete(task_id)
+    threading.Thread(target=run, daemon=True).start()
+
+def test_infer_iter_window(lib):
+    runner = infer.SGInfer('fake.bmodel')
+    consumed = [0]
+    in_flight = []
+
+    def samples():
+        for i in range(20):
+            in_flight.append(i - consumed[0])
+            yield [sample(i)]
+
+    results = []
+    for sample_id, outputs in runner.infer_iter(samples(), window=3):
+        consumed[0] += 1
+        results.append((sample_id, first(outputs)))
+    assert results == [(i, i * 2) for i in range(20)]
+    assert max(in_flight) == 3
+    with pytest.raises(ValueError):
+        next(runner.infer_iter([], window=0))
+
+def test_infer_iter_unordered(lib):
+    lib.auto = False
+    runner = infer.SGInfer('fake.bmodel')
+    results = runner.infer_iter(
+        [[sample(i)] for i in range(4)], window=4, ordered=False,
+        key_func=lambda i, s: f'sample{i}')
+    complete_when_put(lib, 4, 2)
+    sample_id, outputs = next(results)
+    assert sample_id == 'sample2' and first(outputs) == 4
+    for task_id in [3, 0, 1]:
+        lib.complete(task_id)
+        sample_id, outputs = next(results)
+        assert sample_id == f'sample{task_id}' and first(outputs) == task_id * 2
+    with pytest.raises(StopIteration):
+        next(results)
+
+def test_infer_iter_early_close(lib):
+    lib.auto = False
+    runner = infer.SGInfer('fake.bmodel')
+    results = runner.infer_iter([[sample(i)] for i in range(6)], window=3)
+    complete_when_put(lib, 3, 0)
+    assert next(results)[0] == 0
+    results.close()
+    # Nothing more is submitted, tasks left in flight still finish
+    assert sorted(runner.dispatcher.callbacks) == [1, 2]
+    assert sorted(lib.inputs) == [1, 2]
+    for task_id in [1, 2]:
+        lib.complete(task_id)
+    wait_until(lambda: not runner.dispatcher.callbacks)
+    assert not runner.dispatcher.early and not lib.outputs
+    lib.auto = True
+    assert first(runner.infer_one(sample(5))[0]) == 10
+    assert not lib.inputs
+
+# ********************** AsyncSGInfer **********************
+
+def test_async_infer(lib):
+    runner = infer.AsyncSGInfer('fake.bmodel', batch=4, devices=[0])
+
+    async def main():
+        return await asyncio.gather(*[runner.infer(sample(i)) for i in range(8)])
+
+    results = asyncio.run(main())
+    assert [(first(outputs), valid) for outputs, valid in results] == \
+        [(i * 2, True) for i in range(8)]
+    assert not runner.runner.dispatcher.callbacks and not lib.outputs
+
+@pytest.mark.parametrize('ordered', [True, False])
+def test_async_infer_stream(lib, ordered):
+    runner = infer.AsyncSGInfer('fake.bmodel')
+
+    async def samples():
+        for i in range(10):
+            yield i
+
+    async def main():
+        return [
+            (sample_id, first(outputs))
+            async for sample_id, outputs in runner.infer_stream(
+                samples(), window=3, ordered=ordered, in_func=lambda i: [sample(i)],
+                key_func=lambda i, s: s * 10)]
+
+    results = asyncio.run(main())
+    if not ordered:
+        results.sort()
+    assert results == [(i * 10, i * 2) for i in range(10)]
+
+# ********************** latency stats **********************
+
+def test_latency_stats(lib):
+    runner = infer.SGInfer('fake.bmodel')
+    stats = runner.latency_stats(reset=True)
+    assert lib.stats_reset
+    assert stats == dict(qps=400, stages=dict(infer=dict(
+        count=4, mean=2.5, min=1, max=4, p50=2, p90=3, p99=4, p999=4)))
+
+# ********************** submit **********************
+
+def test_submit_after_stop(lib):
+    runner = infer.SGInfer('fake.bmodel')
+    lib.runner_stop(runner.runner_id)
+    with pytest.raises(RuntimeError):
+        runner.submit(sample(0))
+    with pytest.raises(RuntimeError):
+        runner.submit_many([[sample(0)], [sample(0)]])
+    assert not runner.dispatcher.callbacks
+
+def test_async_submit_after_stop(lib):
+    runner = infer.AsyncSGInfer('fake.bmodel')
+    lib.runner_stop(runner.runner.runner_id)
+    with pytest.raises(RuntimeError):
+        asyncio.run(runner.submit(sample(0)))
+
+@pytest.mark.skipif(
+    not os.environ.get('TPU_PERF_TEST_BMODEL'), reason='TPU_PERF_TEST_BMODEL not set')
+def test_submit_after_runner_stop():
+    runner = infer.SGInfer(os.environ['TPU_PERF_TEST_BMODEL'])
+    info = next(iter(runner.get_input_info().values()))
+    data = np.zeros(info['shape'], dtype=infer.nptype(info['dtype']))
+    runner._SGInfer__lib.runner_stop(runner.runner_id)
+    with pytest.raises(RuntimeError):
+        runner.submit(data)
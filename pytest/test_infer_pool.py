@@ -0,0 +1,63 @@
+from concurrent.futures import Future
+import pytest
+from tpu_perf import infer_pool
+
+class FakeRunner:
+    """
+    Runner whose tasks finish when the test resolves their futures.
+    """
+    def __init__(self, bmodel_path, batch, devices, zero_copy):
+        self.device = devices[0]
+        self.futures = []
+
+    def submit(self, *inputs):
+        future = Future()
+        self.futures.append(future)
+        return future
+
+    def finish(self):
+        self.futures.pop(0).set_result(([], True))
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(infer_pool, 'SGInfer', FakeRunner)
+    return infer_pool.SGInferPool('fake.bmodel', devices=[0, 1], runners_per_device=2)
+
+def test_pool_round_robin_on_ties(pool):
+    assert pool.devices == [0, 1, 0, 1]
+    pool.submit()
+    pool.submit()
+    assert [len(r.futures) for r in pool.runners] == [1, 1, 0, 0]
+    pool.submit()
+    pool.submit()
+    assert [len(r.futures) for r in pool.runners] == [1, 1, 1, 1]
+    pool.submit()
+    assert [len(r.futures) for r in pool.runners] == [2, 1, 1, 1]
+
+def test_pool_least_loaded(pool):
+    for _ in range(8):
+        pool.submit()
+    # Runner 2 finishes its tasks and takes the next ones
+    pool.runners[2].finish()
+    pool.runners[2].finish()
+    assert pool.stats()['in_flight'] == 6
+    pool.submit()
+    assert pool.in_flight == [2, 2, 1, 2]
+    pool.runners[3].finish()
+    pool.submit()
+    assert pool.in_flight == [2, 2, 1, 2]
+    # Least loaded first, then ties round robin after the last one taken
+    pool.submit()
+    assert pool.in_flight == [2, 2, 2, 2]
+    pool.submit()
+    assert pool.in_flight == [2, 2, 2, 3]
+
+def test_pool_stats(pool):
+    for _ in range(4):
+        pool.submit()
+    for runner in pool.runners[:3]:
+        runner.finish()
+    stats = pool.stats()
+    assert stats['samples'] == 3
+    assert stats['in_flight'] == 1
+    assert stats['device_samples'] == {0: 2, 1: 1}
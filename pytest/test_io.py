@@ -0,0 +1,259 @@
+import numpy as np
+import pytest
+from tpu_perf import io
+from tpu_perf import blob_pb2 as ufw_blob
+
+# ********************** datum **********************
+
+def full_parse(value):
+    datum = ufw_blob.Datum()
+    datum.ParseFromString(value)
+    return io.datum_to_array(datum)
+
+def test_parse_datum_float_data_not_scanned(monkeypatch):
+    arr = np.random.rand(3, 32, 32).astype(np.float32)
+    value = io.array_to_datum(arr, 1).SerializeToString()
+    calls = []
+    read_varint = io._read_varint
+    def counting(buf, pos):
+        calls.append(pos)
+        return read_varint(buf, pos)
+    monkeypatch.setattr(io, '_read_varint', counting)
+    datum, out = io.parse_datum(value)
+    assert datum.label == 1
+    np.testing.assert_array_equal(out, arr)
+    # Header fields only, not one varint per float element
+    assert len(calls) < 16
+
+def test_split_datum_stops_at_float_data(monkeypatch):
+    arr = np.random.rand(3, 64, 64).astype(np.float32)
+    value = io.array_to_datum(arr, 1).SerializeToString()
+    # Fields are serialized by number, label comes right before float_data
+    header = ufw_blob.Datum(label=1).SerializeToString()
+    assert value.startswith(header)
+    calls = []
+    read_varint = io._read_varint
+    def counting(buf, pos):
+        calls.append(pos)
+        return read_varint(buf, pos)
+    monkeypatch.setattr(io, '_read_varint', counting)
+    assert io._split_datum(memoryview(value)) is None
+    # Nothing is read past the float_data tag
+    assert max(calls) == len(header)
+    np.testing.assert_array_equal(io.parse_datum(value)[1], full_parse(value))
+
+def test_parse_datum_raw_is_view():
+    arr = np.arange(24, dtype=np.int16).reshape(2, 3, 4)
+    value = io.array_to_datum(arr, encoding='raw').SerializeToString()
+    datum, out = io.parse_datum(value)
+    np.testing.assert_array_equal(out, arr)
+    assert not out.flags.owndata
+    assert not datum.data
+
+# ********************** resize **********************
+
+def smooth_image(rng, h, w, k=3):
+    coarse = rng.random((h // 8 + 2, w // 8 + 2, k)).astype(np.float32)
+    return io.resize_images(coarse, (h, w))
+
+@pytest.mark.parametrize('src, dst', [
+    ((96, 128), (32, 48)),
+    ((64, 64), (48, 48)),
+    ((32, 48), (96, 128)),
+    ((40, 40), (100, 100))])
+def test_resize_images_close_to_resize_image(src, dst):
+    pytest.importorskip('skimage')
+    im = smooth_image(np.random.default_rng(0), *src)
+    ref = io.resize_image(im, dst)
+    fast = io.resize_images(im, dst)
+    assert fast.shape == ref.shape
+    diff = np.abs(fast - ref)
+    if dst[0] < src[0]:
+        # No anti-aliasing in the fast path
+        assert diff.mean() < 0.03
+        assert diff.max() < 0.2
+    else:
+        # resize_image pads edges with the image minimum, resize_images clamps
+        assert diff[1:-1, 1:-1].max() < 1e-4
+        assert diff.mean() < 0.02
+
+def make_transformer(shape):
+    transformer = io.Transformer({'data': shape})
+    transformer.set_transpose('data', (2, 0, 1))
+    transformer.set_channel_swap('data', (2, 1, 0))
+    transformer.set_raw_scale('data', 255)
+    transformer.set_mean('data', np.array([104, 117, 123], dtype=np.float32))
+    transformer.set_input_scale('data', 0.5)
+    return transformer
+
+def test_preprocess_batch_matches_preprocess():
+    pytest.importorskip('skimage')
+    rng = np.random.default_rng(1)
+    transformer = make_transformer((2, 3, 32, 40))
+    batch = np.stack([smooth_image(rng, 64, 80) for _ in range(2)])
+    ref = np.stack([transformer.preprocess('data', im) for im in batch])
+    np.testing.assert_allclose(
+        transformer.preprocess_batch('data', batch), ref, rtol=1e-5, atol=1e-3)
+    fast = transformer.preprocess_batch('data', batch, fast_resize=True)
+    assert np.abs(fast - ref).mean() < 0.03 * 255 * 0.5
+
+def test_preprocess_batch_same_size():
+    rng = np.random.default_rng(2)
+    transformer = make_transformer((2, 3, 16, 16))
+    batch = rng.random((2, 16, 16, 3)).astype(np.float32)
+    ref = np.stack([transformer.preprocess('data', im) for im in batch])
+    out = np.empty((2, 3, 16, 16), dtype=np.float32)
+    assert transformer.preprocess_batch('data', batch, out=out) is out
+    np.testing.assert_allclose(out, ref, rtol=1e-5, atol=1e-4)
+
+@pytest.mark.parametrize('swap', [None, (2, 1, 0), (0, 1, 2), (1, 0, 2)])
+def test_preprocess_batch_affine(swap):
+    rng = np.random.default_rng(3)
+    transformer = io.Transformer({'data': (3, 3, 8, 8)})
+    transformer.set_transpose('data', (2, 0, 1))
+    if swap is not None:
+        transformer.set_channel_swap('data', swap)
+    batch = rng.integers(0, 256, (3, 8, 8, 3)).astype(np.uint8)
+    def check():
+        ref = np.stack([transformer.preprocess('data', im) for im in batch])
+        np.testing.assert_allclose(
+            transformer.preprocess_batch('data', batch), ref, rtol=1e-5, atol=1e-3)
+    check()
+    transformer.set_mean('data', rng.random((3, 8, 8)).astype(np.float32) * 100)
+    check()
+    # Cached scale and bias follow later setters
+    transformer.set_input_scale('data', 0.25)
+    transformer.set_raw_scale('data', 2)
+    check()
+    assert io._channel_index((2, 1, 0)) == slice(2, None, -1)
+    assert io._channel_index((1, 0, 2)) == [1, 0, 2]
+
+def test_transform_stage_timed_once(monkeypatch):
+    transformer = make_transformer((2, 3, 8, 8))
+    batch = np.random.rand(2, 16, 16, 3).astype(np.float32)
+    added = []
+    monkeypatch.setattr(io, 'add_stats', added.append)
+    # resize_images nests in preprocess_batch, and is not counted again
+    transformer.preprocess_batch('data', batch, fast_resize=True)
+    io.oversample(batch, (8, 8))
+    assert [list(stats) for stats in added] == [['transform_time'], ['transform_time']]
+
+# ********************** lmdb reader **********************
+
+def write_lmdb(path, values):
+    with io.LMDB_Dataset(str(path)) as writer:
+        for i, v in enumerate(values):
+            writer.put(np.full((2, 3), v, dtype=np.float32), labels=i, keys=f'{i:02d}')
+
+def test_lmdb_reader_survives_replaced_dataset(tmp_path):
+    path = tmp_path / 'data'
+    write_lmdb(path, [1, 2])
+    reader = io.LMDBReader(str(path))
+    shard = reader.shard(1, 2)
+    # Replace the dataset by another with different keys, as make_lmdb does
+    write_lmdb(tmp_path / 'new', [5, 6, 7, 8])
+    path.rename(tmp_path / 'old')
+    (tmp_path / 'new').rename(path)
+    arr, label = reader[1]
+    assert arr[0, 0] == 2 and label == 1
+    assert shard[0][0][0, 0] == 2
+    assert reader.clone().get_batch([0, 1])[0][:, 0, 0].tolist() == [1, 2]
+    new = io.LMDBReader(str(path))
+    assert len(new) == 4
+    assert new[3][0][0, 0] == 8
+    # A reader which has to reopen the path sees it was replaced
+    reader.close()
+    with pytest.raises(RuntimeError):
+        reader[0]
+
+class NoGetmulti:
+    """
+    Transaction of a py-lmdb without Cursor.getmulti.
+    """
+    def __init__(self, txn):
+        self.txn = txn
+
+    def cursor(self):
+        return object()
+
+    def get(self, key):
+        return self.txn.get(key)
+
+def test_get_values_without_getmulti(tmp_path):
+    path = tmp_path / 'data'
+    write_lmdb(path, [1, 2, 3])
+    reader = io.LMDBReader(str(path))
+    keys = [reader.keys[2], b'missing', reader.keys[0]]
+    with io.open_lmdb(str(path)).begin() as txn:
+        values = io._get_values(txn, keys)
+        assert io._get_values(NoGetmulti(txn), keys) == values
+    assert list(values) == [reader.keys[2], reader.keys[0]]
+
+# ********************** datum encodings **********************
+
+def write_config(tmp_path, **input_config):
+    config = dict(lmdb_out=str(tmp_path / 'data'), input=input_config)
+    samples = [np.random.randint(0, 256, (3, 8, 6)).astype(np.float32) for _ in range(5)]
+    with io.dataset_writer(config) as writer:
+        for i, arr in enumerate(samples):
+            writer.put(arr, labels=i)
+    return config, samples
+
+def read_back(config):
+    return [arr for _, arr in io.lmdb_data(config['lmdb_out'], copy=True)]
+
+@pytest.mark.parametrize('encoding, compress', [
+    ('legacy', None),
+    ('raw', None),
+    ('raw', 'zlib'),
+    ('raw', 'lz4'),
+    ('uint8', None),
+    ('uint8', 'zlib'),
+    ('uint8', 'lz4')])
+def test_dataset_writer_encoding_round_trip(tmp_path, encoding, compress):
+    if compress == 'lz4':
+        pytest.importorskip('lz4.block')
+    input_config = dict(encoding=encoding)
+    if compress is not None:
+        input_config['compress'] = compress
+    config, samples = write_config(tmp_path, **input_config)
+    codec = io.datum_codecs.get(compress, ufw_blob.Datum.NONE)
+    with io.open_lmdb(config['lmdb_out']).begin() as txn:
+        datum = ufw_blob.Datum()
+        datum.ParseFromString(next(iter(txn.cursor()))[1])
+    assert datum.codec == codec
+    assert datum.HasField('storage_dtype') == (encoding == 'uint8')
+    for arr, expected in zip(read_back(config), samples):
+        assert arr.dtype == np.float32
+        np.testing.assert_array_equal(arr, expected)
+
+def test_uint8_encoding_rejects_fractions(tmp_path):
+    config = dict(lmdb_out=str(tmp_path / 'data'), input=dict(encoding='uint8'))
+    with pytest.raises(ValueError):
+        with io.dataset_writer(config) as writer:
+            writer.put(np.full((2, 2), 0.5, dtype=np.float32))
+
+def test_failed_put_leaves_writer_unchanged(tmp_path):
+    path = str(tmp_path / 'data')
+    good = np.full((2, 2), 3, dtype=np.float32)
+    with io.LMDB_Dataset(path, encoding='uint8') as writer:
+        writer.put(good, labels=0, keys='a')
+        with pytest.raises(ValueError):
+            writer.put([good, np.full((2, 2), 0.5, dtype=np.float32)], labels=[1, 2])
+        assert writer.index == 1
+        assert len(writer.key_list) == len(writer.value_list) == 1
+        writer.put(good + 1, labels=3, keys='b')
+    assert writer.written == 2
+    data = list(io.lmdb_data(path, copy=True))
+    assert [key for key, _ in data] == [b'0000000000__a', b'0000000001__b']
+    assert [arr[0, 0] for _, arr in data] == [3, 4]
+
+def test_lz4_missing(tmp_path, monkeypatch):
+    value = io.array_to_datum(np.ones((2, 2), dtype=np.float32), compress='zlib')
+    value.codec = ufw_blob.Datum.LZ4
+    monkeypatch.setattr(io, 'lz4', None)
+    config = dict(lmdb_out=str(tmp_path / 'data'), input=dict(encoding='raw', compress='lz4'))
+    with pytest.raises(RuntimeError):
+        io.dataset_writer(config)
+    with pytest.raises(RuntimeError):
+        io.parse_datum(value.SerializeToString())
@@ -0,0 +1,67 @@
+import sys
+import time
+import numpy as np
+import pytest
+from tpu_perf import io
+from tpu_perf.loader import LMDBLoader
+
+@pytest.fixture
+def dataset(tmp_path):
+    path = str(tmp_path / 'data')
+    with io.LMDB_Dataset(path) as writer:
+        for i in range(10):
+            writer.put(np.full((2, 3), i, dtype=np.float32), labels=i)
+    return path
+
+modes = [
+    False,
+    pytest.param(True, marks=pytest.mark.skipif(
+        sys.version_info < (3, 8), reason='process workers need Python 3.8+'))]
+
+@pytest.mark.parametrize('processes', modes)
+def test_loader_order(dataset, processes):
+    with LMDBLoader(dataset, batch_size=3, workers=2, processes=processes) as loader:
+        assert len(loader) == 4
+        batches = [(batch.copy(), labels.tolist()) for batch, labels in loader]
+    assert [len(labels) for _, labels in batches] == [3, 3, 3, 1]
+    values = np.concatenate([batch[:, 0, 0] for batch, _ in batches])
+    assert values.tolist() == list(range(10))
+    assert sum((labels for _, labels in batches), []) == list(range(10))
+
+@pytest.mark.parametrize('processes', modes)
+def test_loader_early_break(dataset, processes):
+    with LMDBLoader(
+            dataset, batch_size=2, workers=2, prefetch=3, processes=processes) as loader:
+        for batch, labels in loader:
+            assert labels.tolist() == [0, 1]
+            break
+        # Prefetched batches are drained, so a new pass starts over
+        first, labels = next(iter(loader))
+        assert labels.tolist() == [0, 1]
+        assert loader.batch_count == 0
+
+def test_loader_drop_last(dataset):
+    with LMDBLoader(dataset, batch_size=3, drop_last=True) as loader:
+        assert len(loader) == 3
+        assert sum(len(labels) for _, labels in loader) == 9
+
+def test_loader_stall_counters(dataset):
+    with LMDBLoader(dataset, batch_size=5, workers=1) as loader:
+        for _ in loader:
+            time.sleep(0.05)
+        stats = loader.stats()
+    assert stats['batches'] == 2
+    assert stats['device_wait'] >= 0.1
+    assert stats['data_wait'] >= 0
+    total = stats['data_wait'] + stats['device_wait']
+    assert stats['data_stall'] == pytest.approx(stats['data_wait'] / total)
+    loader.reset_stats()
+    assert loader.stats() == dict(batches=0, data_wait=0, device_wait=0, data_stall=0)
+
+def test_loader_processes_need_shared_memory(dataset, monkeypatch):
+    from tpu_perf import loader
+    monkeypatch.setattr(loader, 'shared_memory', None)
+    with pytest.raises(RuntimeError):
+        LMDBLoader(dataset, processes=True)
+    with LMDBLoader(dataset, batch_size=4) as threads:
+        assert len(list(threads)) == 3
@@ -0,0 +1,84 @@
+import os
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from tpu_perf import loadgen
+
+class FakeTree:
+    def __init__(self, **global_config):
+        self.global_config = global_config
+
+    def expand_variables(self, config, s):
+        return s.replace('$(workdir)', config['workdir'])
+
+def test_iter_bmodels_applies_loops(tmp_path):
+    tree = FakeTree(int8_loops=[dict(prec='INT8_SYM')])
+    config = dict(
+        name='m', workdir=str(tmp_path), fp_compile_options='x', fp_batch_sizes=[1, 4],
+        fp_loops=[
+            dict(fp_outdir_template='{}b.fp16.compilation', prec='FP16'),
+            dict(fp_outdir_template='{}b.fp32.compilation')],
+        bmnetu_options='x', bmnetu_batch_sizes=[8])
+    bmodels = [
+        (c['prec'], name, b, os.path.relpath(bmodel, tmp_path))
+        for c, name, b, bmodel in loadgen.iter_bmodels(tree, config)]
+    assert bmodels == [
+        ('FP16', '1b.fp16.compilation', 1, '1b.fp16.compilation/compilation.bmodel'),
+        ('FP16', '4b.fp16.compilation', 4, '4b.fp16.compilation/compilation.bmodel'),
+        ('FP32', '1b.fp32.compilation', 1, '1b.fp32.compilation/compilation.bmodel'),
+        ('FP32', '4b.fp32.compilation', 4, '4b.fp32.compilation/compilation.bmodel'),
+        ('INT8_SYM', '8b.compilation', 8, '8b.compilation/compilation.bmodel')]
+    assert not list(loadgen.iter_bmodels(tree, dict(config, time=False)))
+
+def test_iter_bmodels_mlir(tmp_path):
+    (tmp_path / 'a_f16').mkdir()
+    (tmp_path / 'a_f16' / 'compilation.bmodel').touch()
+    config = dict(name='m', workdir=str(tmp_path), num_core=1, deploy=[
+        '--chip bm1684x --model $(workdir)/a_f16.bmodel --quantize F16',
+        '--chip bm1684x --model $(workdir)/a_int8.bmodel --quantize INT8 --asymmetric'])
+    bmodels = [
+        (c['prec'], name, b, os.path.relpath(bmodel, tmp_path))
+        for c, name, b, bmodel in loadgen.iter_bmodels(FakeTree(), config, mlir=True)]
+    assert bmodels == [
+        ('FP16', 'a_f16', 1, 'a_f16/compilation.bmodel'),
+        ('INT8-asym', 'a_int8', 1, 'a_int8.bmodel')]
+
+class FakeInfer:
+    """
+    A single server taking service_time per request.
+    """
+    def __init__(self, service_time=0.002):
+        self.service_time = service_time
+        self.executor = ThreadPoolExecutor(1)
+
+    def submit(self, *inputs):
+        return self.executor.submit(time.sleep, self.service_time)
+
+def sweep_args(**kwargs):
+    args = dict(rates=None, fractions=[0.2], duration=0.3, arrival='constant', slo=50)
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+def test_run_load_open_loop():
+    stats = loadgen.run_load(FakeInfer(), [], 100, 0.3, arrival='constant')
+    assert stats['target_qps'] == 100
+    assert 25 <= stats['samples'] <= 35
+    assert stats['latency_p50'] < 50
+    assert stats['latency_p50'] <= stats['latency_p90'] <= stats['latency_p99']
+
+def test_sweep_and_slo_search():
+    results = loadgen.sweep(FakeInfer(), [], sweep_args(rates=[50, 2000]))
+    assert [s['target_qps'] for s in results] == [50, 2000]
+    # Overload queues up, latency measured from the scheduled arrival grows
+    assert [s['slo_met'] for s in results] == [True, False]
+    assert results[1]['latency_p99'] > 100
+    assert loadgen.best_under_slo(results) is results[0]
+    assert loadgen.best_under_slo(results[1:]) is None
+
+def test_sweep_fractions_of_peak():
+    results = loadgen.sweep(FakeInfer(), [], sweep_args(fractions=[0.1, 0.2]))
+    # Peak of a 2ms server is at most 500/s
+    rates = [s['target_qps'] for s in results]
+    assert 0 < rates[0] <= 50 and rates[1] == pytest.approx(rates[0] * 2)
+    assert all(s['slo_met'] for s in results)
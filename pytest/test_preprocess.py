@@ -0,0 +1,101 @@
+import os
+import glob
+import numpy as np
+import pytest
+from tpu_perf import io
+from tpu_perf.preprocess import preprocess_method, read_manifest, dataset_up_to_date
+from tpu_perf.make_lmdb import build_lmdb
+
+def list_files(tree, config):
+    return sorted(glob.glob(os.path.join(config['input']['dir'], '*.txt')))
+
+@preprocess_method('test_files', list_inputs=list_files)
+def write_files(tree, config, inputs, writer):
+    # One call per chunk, logged to tell calls apart from inputs
+    with open(os.path.join(config['input']['dir'], 'calls.log'), 'a') as f:
+        f.write(f'{len(inputs)}\n')
+    for fn in inputs:
+        with open(fn) as f:
+            value = int(f.read())
+        name = os.path.basename(fn)
+        for i in range(value % 3 + 1):
+            writer.put(np.full((2, 2), value * 10 + i, dtype=np.float32), keys=name)
+        writer.input_done()
+
+@preprocess_method('test_unmarked', list_inputs=list_files)
+def write_unmarked(tree, config, inputs, writer):
+    for fn in inputs:
+        writer.put(np.zeros((2, 2), dtype=np.float32))
+
+def write_input(path, name, value):
+    with open(os.path.join(path, name), 'w') as f:
+        f.write(str(value))
+
+def expected(path):
+    samples = []
+    for fn in list_files(None, dict(input=dict(dir=path))):
+        with open(fn) as f:
+            value = int(f.read())
+        samples += [(os.path.basename(fn), value * 10 + i) for i in range(value % 3 + 1)]
+    return samples
+
+def read_dataset(path):
+    return [
+        (key.split(b'__', 1)[1].decode(), arr[0, 0])
+        for key, arr in io.lmdb_data(path, copy=True)]
+
+def read_calls(path):
+    fn = os.path.join(path, 'calls.log')
+    if not os.path.exists(fn):
+        return []
+    with open(fn) as f:
+        calls = [int(line) for line in f]
+    os.remove(fn)
+    return calls
+
+@pytest.mark.parametrize('shard_output', ['merge', 'split'])
+def test_sharded_rebuild_patches_inputs(tmp_path, shard_output):
+    inputs = tmp_path / 'inputs'
+    inputs.mkdir()
+    for i in range(7):
+        write_input(inputs, f'{i:02d}.txt', i)
+    out_path = str(tmp_path / 'data')
+    config = dict(name='test', lmdb_out=out_path, input=dict(
+        preprocess='test_files', dir=str(inputs), shards=2, chunk_size=3,
+        shard_output=shard_output))
+
+    assert build_lmdb(None, 'test', config)['new_samples'] == 13
+    assert sorted(read_calls(inputs)) == [1, 3, 3]
+    assert read_dataset(out_path) == expected(inputs)
+    assert build_lmdb(None, 'test', config) is None
+
+    # Modify, add and remove inputs, keeping mtime apart from the build
+    write_input(inputs, '02.txt', 5)
+    os.utime(inputs / '02.txt', ns=(1, 1))
+    write_input(inputs, '07.txt', 8)
+    os.remove(inputs / '04.txt')
+    assert not dataset_up_to_date(None, config)
+    stats = build_lmdb(None, 'test', config)
+    assert read_calls(inputs) == [2]
+    assert stats['new_samples'] == 3 + 3
+    samples = read_dataset(out_path)
+    assert samples == expected(inputs)
+    assert stats['samples'] == len(samples)
+    # Keys are dense, as if built from scratch
+    keys = [key for key, _ in io.lmdb_data(out_path)]
+    assert [int(k.split(b'__', 1)[0]) for k in keys] == list(range(len(samples)))
+    manifest = read_manifest(out_path)
+    assert [os.path.basename(e['stat'][0]) for e in manifest['inputs']] == \
+        [os.path.basename(fn) for fn in list_files(None, config)]
+    assert sum(len(e['keys']) for e in manifest['inputs']) == len(samples)
+    assert not os.path.exists(f'{out_path}.partial')
+
+def test_sharded_plugin_must_mark_inputs(tmp_path):
+    inputs = tmp_path / 'inputs'
+    inputs.mkdir()
+    for i in range(2):
+        write_input(inputs, f'{i:02d}.txt', i)
+    config = dict(name='test', lmdb_out=str(tmp_path / 'data'), input=dict(
+        preprocess='test_unmarked', dir=str(inputs), shards=1))
+    with pytest.raises(RuntimeError):
+        build_lmdb(None, 'test', config)
@@ -0,0 +1,129 @@
+import time
+import queue
+import threading
+import numpy as np
+from concurrent.futures import Future
+from .infer import SGInferBase
+
+class SGBatcher(SGInferBase):
+    """
+    Dynamic micro-batcher in front of SGInfer for static batch-N bmodels.
+
+    Requests with a small leading batch dimension (usually 1) are coalesced
+    into model sized batches. A batch is sent when it is full or when the
+    oldest request has waited max_wait seconds. The runner pads incomplete
+    batches, and outputs are split back per request along the first axis.
+    """
+    def __init__(self, infer, max_batch=None, max_wait=0.002):
+        self.infer = infer
+        if max_batch is None:
+            info = infer.get_input_info()
+            max_batch = next(iter(info.values()))['shape'][0]
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batch_count = 0
+        self.sample_count = 0
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.closed = False
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+
+    def submit(self, *inputs):
+        """
+        Queue one request and return a concurrent.futures.Future of
+        (outputs, valid) for its own samples only. Raises RuntimeError
+        once the batcher is closed.
+        """
+        num = inputs[0].shape[0]
+        if num > self.max_batch:
+            raise ValueError(f'request batch {num} exceeds model batch {self.max_batch}')
+        future = Future()
+        with self.lock:
+            if self.closed:
+                raise RuntimeError('batcher closed')
+            self.queue.put((inputs, num, future))
+        return future
+
+    def mean_batch(self):
+        return self.sample_count / self.batch_count if self.batch_count else 0
+
+    def close(self):
+        """
+        Stop taking requests, and wait until queued ones are dispatched.
+        """
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.queue.put(None)
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __run(self):
+        carry = None
+        stop = False
+        while not stop:
+            request = carry or self.queue.get()
+            carry = None
+            if request is None:
+                break
+            batch = [request]
+            size = request[1]
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if request is None:
+                    stop = True
+                    break
+                if size + request[1] > self.max_batch:
+                    carry = request
+                    break
+                batch.append(request)
+                size += request[1]
+            self.__dispatch(batch, size)
+
+    def __dispatch(self, batch, size):
+        self.batch_count += 1
+        self.sample_count += size
+        if len(batch) == 1:
+            inputs = batch[0][0]
+        else:
+            inputs = [
+                np.concatenate([request[0][i] for request in batch])
+                for i in range(len(batch[0][0]))]
+        try:
+            future = self.infer.submit(*inputs)
+        except Exception as err:
+            for _, _, request_future in batch:
+                if request_future.set_running_or_notify_cancel():
+                    request_future.set_exception(err)
+            return
+        future.add_done_callback(lambda f: self.__split(batch, f))
+
+    @staticmethod
+    def __split(batch, future):
+        error = future.exception()
+        offset = 0
+        for _, num, request_future in batch:
+            if not request_future.set_running_or_notify_cancel():
+                offset += num
+                continue
+            if error is not None:
+                request_future.set_exception(error)
+                continue
+            outputs, valid = future.result()
+            request_future.set_result((
+                [o[offset:offset + num] for o in outputs], valid))
+            offset += num
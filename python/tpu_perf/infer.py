@@ -2,7 +2,11 @@ import os
 import ctypes as ct
 import numpy as np
 import time
+import asyncio
 import threading
+from collections import deque
+from functools import partial
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 SGTypeTuple = (
    (np.float32, 0),
@@ -11,6 +15,9 @@ SGTypeTuple = (
    (np.int8, 2),
    (np.uint8, 3),
 )
+# Task id returned by runner_put_input for an invalid or stopped runner
+INVALID_TASK_ID = 0xFFFFFFFF
+
 def sglen(t):
     if t in [2,3]:
         return 1
@@ -33,14 +40,20 @@ class SGTensor(ct.Structure):
         ("dtype", ct.c_uint32),
         ("data", ct.c_void_p),
     ]
-    def to_numpy(self):
+    def to_numpy(self, owner=None):
+        """
+        Wrap tensor data as numpy array. Data is copied unless owner is given,
+        in which case the array points to native memory and keeps owner alive.
+        """
         shape = self.shape[0:self.dims]
         dtype = nptype(self.dtype)
-        mem_size = np.prod(shape)*sglen(self.dtype)
-        data_ptr = (ct.c_byte*mem_size)()
-        ct.memmove(data_ptr, self.data, mem_size)
-        #data_ptr = ct.cast(self.data, ct.POINTER(ct.c_byte*mem_size)).contents
-        buffer = data_ptr
+        mem_size = int(np.prod(shape))*sglen(self.dtype)
+        if owner is None:
+            buffer = (ct.c_byte*mem_size)()
+            ct.memmove(buffer, self.data, mem_size)
+        else:
+            buffer = (ct.c_byte*mem_size).from_address(self.data)
+            buffer._owner = owner
         return np.frombuffer(buffer, dtype = dtype).reshape(shape)
         
     def from_numpy(self, data):
@@ -58,14 +71,258 @@ class BlobInfo(ct.Structure):
         ("dims", ct.c_int * 8),
         ("scale", ct.c_float)]
 
-class SGInfer:
+class LatencyStats(ct.Structure):
+    _fields_ = [
+        ("name", ct.c_char_p),
+        ("count", ct.c_ulonglong),
+        ("mean", ct.c_double),
+        ("min", ct.c_uint32),
+        ("max", ct.c_uint32),
+        ("p50", ct.c_uint32),
+        ("p90", ct.c_uint32),
+        ("p99", ct.c_uint32),
+        ("p999", ct.c_uint32)]
+
+class SGOutputBuffer:
+    """
+    Owner of native output tensors returned by runner.
+    Tensors are released when the last numpy view is garbage-collected.
+    """
+    def __init__(self, lib, num, tensors):
+        self.lib = lib
+        self.num = num
+        self.tensors = tensors
+
+    def __del__(self):
+        self.lib.runner_release_output(self.num, self.tensors)
+
+def load_library():
+    """
+    Load libpipeline.so and declare signatures of the hot path functions once.
+    """
+    lib_path = os.path.join(os.path.dirname(__file__), "libpipeline.so")
+    lib = ct.cdll.LoadLibrary(lib_path)
+    uint_p = ct.POINTER(ct.c_uint32)
+    tensor_p = ct.POINTER(SGTensor)
+    lib.runner_put_input.argtypes = [ct.c_uint32, ct.c_uint32, tensor_p, ct.c_int]
+    lib.runner_put_input.restype = ct.c_uint32
+    lib.runner_put_inputs.argtypes = [ct.c_uint32, ct.c_uint32, ct.c_uint32, tensor_p, ct.c_int, uint_p]
+    lib.runner_put_inputs.restype = ct.c_uint32
+    for func in [lib.runner_get_output, lib.runner_try_to_get_output]:
+        func.argtypes = [ct.c_uint32, uint_p, uint_p, uint_p]
+        func.restype = tensor_p
+    lib.runner_get_outputs.argtypes = [
+        ct.c_uint32, ct.c_uint32, ct.c_int, uint_p, uint_p, uint_p, ct.POINTER(tensor_p)]
+    lib.runner_get_outputs.restype = ct.c_uint32
+    lib.runner_release_output.argtypes = [ct.c_uint32, tensor_p]
+    lib.get_input_info.restype = ct.POINTER(BlobInfo)
+    lib.get_output_info.restype = ct.POINTER(BlobInfo)
+    lib.get_runner_durations.restype = uint_p
+    lib.get_runner_latency_stats.argtypes = [
+        ct.c_uint32, ct.POINTER(LatencyStats), ct.c_uint32, ct.POINTER(ct.c_double), ct.c_int]
+    lib.get_runner_latency_stats.restype = ct.c_uint32
+    return lib
+
+def wrap_output(lib, task_id, output_num, output_valid, output_tensors, zero_copy=False):
+    outputs = []
+    if not output_valid:
+        if output_tensors:
+            lib.runner_release_output(output_num, output_tensors)
+        return task_id, [], False
+    if zero_copy:
+        owner = SGOutputBuffer(lib, output_num, output_tensors)
+        for i in range(output_num):
+            outputs.append(output_tensors[i].to_numpy(owner))
+        return task_id, outputs, True
+    for i in range(output_num):
+        outputs.append(output_tensors[i].to_numpy())
+    lib.runner_release_output(output_num, output_tensors)
+    return task_id, outputs, True
+
+def get_output(lib, func, runner_id, zero_copy=False):
+    output_num= ct.c_uint32(0)
+    task_id = ct.c_uint32(0)
+    output_valid = ct.c_uint32(0)
+    output_tensors = func(runner_id, ct.byref(task_id), ct.byref(output_num), ct.byref(output_valid))
+    if task_id.value == 0:
+        return 0, [], 0
+    return wrap_output(
+        lib, task_id.value, output_num.value, output_valid.value, output_tensors, zero_copy)
+
+def get_outputs(lib, runner_id, max_num, wait=True, zero_copy=False):
+    """
+    Fetch up to max_num outputs in one native call. If wait is set, block
+    until at least one output is ready. Returns list of (task_id, outputs, valid).
+    """
+    task_ids = (ct.c_uint32*max_num)()
+    output_nums = (ct.c_uint32*max_num)()
+    output_valids = (ct.c_uint32*max_num)()
+    output_tensors = (ct.POINTER(SGTensor)*max_num)()
+    num = lib.runner_get_outputs(
+        runner_id, max_num, wait, task_ids, output_nums, output_valids, output_tensors)
+    return [
+        wrap_output(
+            lib, task_ids[i], output_nums[i], output_valids[i], output_tensors[i], zero_copy)
+        for i in range(num)]
+
+class SGDispatcher:
+    """
+    Single background reader routing runner outputs to per task callbacks.
+    Callbacks are called as callback(outputs, valid, error) on the reader
+    thread, error is set if the runner stopped before the task finished.
+
+    Once a dispatcher is used, all outputs of the runner are consumed by it,
+    SGInfer.get should not be called concurrently.
+    """
+    def __init__(self, lib, runner_id, zero_copy=False):
+        self.lib = lib
+        self.runner_id = runner_id
+        self.zero_copy = zero_copy
+        self.lock = threading.Lock()
+        self.callbacks = dict()
+        self.early = dict()
+        self.thread = None
+        self.stopped = False
+        # Max outputs drained per native call
+        self.batch = 64
+
+    def watch(self, task_id, callback):
+        with self.lock:
+            if task_id in self.early:
+                outputs, valid = self.early.pop(task_id)
+            elif self.stopped:
+                outputs, valid = None, False
+            else:
+                self.callbacks[task_id] = callback
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self.__run, daemon=True)
+                    self.thread.start()
+                return
+        if outputs is None:
+            callback([], False, RuntimeError('runner stopped'))
+        else:
+            callback(outputs, valid, None)
+
+    def __dispatch(self, results):
+        if not results:
+            return False
+        ready = []
+        with self.lock:
+            for task_id, outputs, valid in results:
+                callback = self.callbacks.pop(task_id, None)
+                if callback is None:
+                    # Output arrived before the task was watched
+                    self.early[task_id] = (outputs, valid)
+                    continue
+                ready.append((callback, outputs, valid))
+        for callback, outputs, valid in ready:
+            callback(outputs, valid, None)
+        return True
+
+    def __run(self):
+        # Blocks in native code; ctypes releases the GIL during the call.
+        # Outputs are only referenced in __dispatch, so zero copy buffers are
+        # not kept alive by this frame while waiting for the next ones.
+        while self.__dispatch(get_outputs(
+                self.lib, self.runner_id, self.batch, True, self.zero_copy)):
+            pass
+        with self.lock:
+            self.stopped = True
+            callbacks = self.callbacks
+            self.callbacks = dict()
+        for callback in callbacks.values():
+            callback([], False, RuntimeError('runner stopped'))
+
+class SGInferBase:
+    """
+    Helpers built on submit(*inputs), which returns a future of (outputs, valid).
+    """
+    def infer_one(self, *inputs):
+        return self.submit(*inputs).result()
+
+    def infer_all(self, samples, key_func=None, out_func=None, in_func=None):
+        if len(samples) == 0:
+            return
+        results = [None] * len(samples)
+        errors = []
+        remaining = [len(samples)]
+        lock = threading.Lock()
+        finished = threading.Event()
+
+        # Called on the completion thread as soon as each sample finishes
+        def store(index, sample_id, future):
+            try:
+                outputs, valid = future.result()
+                if out_func is not None:
+                    outputs = out_func(sample_id, outputs)
+                results[index] = outputs
+            except BaseException as err:
+                errors.append(err)
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    finished.set()
+
+        for i, sample in enumerate(samples):
+            sample_id = key_func(i, sample) if key_func else i
+            if in_func is not None:
+                sample = in_func(sample)
+            future = self.submit(*sample)
+            future.add_done_callback(partial(store, i, sample_id))
+        finished.wait()
+        if errors:
+            raise errors[0]
+        return results
+
+    def infer_iter(self, samples, window=16, ordered=True, key_func=None, in_func=None):
+        """
+        Stream samples through the runner, keeping at most window tasks
+        in flight. Samples can be any iterable and are consumed lazily.
+
+        Yields (sample_id, outputs) in submission order, or in completion
+        order if ordered is False.
+        """
+        if window < 1:
+            raise ValueError('window should be positive')
+        pending = deque()
+        futures = dict()
+
+        def collect():
+            if ordered:
+                sample_id, future = pending.popleft()
+                outputs, valid = future.result()
+                yield sample_id, outputs
+                return
+            done, _ = wait(futures.keys(), return_when=FIRST_COMPLETED)
+            for future in done:
+                outputs, valid = future.result()
+                yield futures.pop(future), outputs
+
+        def in_flight():
+            return len(pending) if ordered else len(futures)
+
+        for i, sample in enumerate(samples):
+            while in_flight() >= window:
+                yield from collect()
+            sample_id = key_func(i, sample) if key_func else i
+            if in_func is not None:
+                sample = in_func(sample)
+            future = self.submit(*sample)
+            if ordered:
+                pending.append((sample_id, future))
+            else:
+                futures[future] = sample_id
+        while in_flight():
+            yield from collect()
+
+class SGInfer(SGInferBase):
     __lib = None
 
-    def __init__(self, bmodel_path, batch=1, devices=None):
+    def __init__(self, bmodel_path, batch=1, devices=None, zero_copy=False):
         self.bmodel_path = bmodel_path
+        self.zero_copy = zero_copy
         if self.__class__.__lib is None:
-            lib_path = os.path.join(os.path.dirname(__file__), "libpipeline.so")
-            self.__class__.__lib = ct.cdll.LoadLibrary(lib_path)
+            self.__class__.__lib = load_library()
         self.__lib = self.__class__.__lib
         if devices is not None:
             device_ids = (ct.c_int*len(devices))(*devices)
@@ -75,12 +332,13 @@ class SGInfer:
         if devices is not None:
             device_num = ct.c_int(0)
             self.__lib.runner_use_devices(device_ids, device_num)
+        self.dispatcher = SGDispatcher(self.__lib, self.runner_id, zero_copy)
+        self.__put_lock = threading.Lock()
 
     @classmethod
     def available_devices(cls):
         if cls.__lib is None:
-            lib_path = os.path.join(os.path.dirname(__file__), "libpipeline.so")
-            cls.__lib = ct.cdll.LoadLibrary(lib_path)
+            cls.__lib = load_library()
         max_num = ct.c_int(1024);
         devices = (ct.c_int*max_num.value)()
         real_num = cls.__lib.available_devices(devices, max_num)
@@ -88,7 +346,6 @@ class SGInfer:
 
     def get_input_info(self):
         num = ct.c_uint32(0)
-        self.__lib.get_input_info.restype = ct.POINTER(BlobInfo)
         infos = self.__lib.get_input_info(self.runner_id, ct.byref(num))
         result = dict()
         for _, info in zip(range(num.value), infos):
@@ -101,7 +358,6 @@ class SGInfer:
 
     def get_output_info(self):
         num = ct.c_uint32(0)
-        self.__lib.get_output_info.restype = ct.POINTER(BlobInfo)
         infos = self.__lib.get_output_info(self.runner_id, ct.byref(num))
         result = dict()
         for _, info in zip(range(num.value), infos):
@@ -119,15 +375,48 @@ class SGInfer:
         if not inputs:
             self.__lib.runner_join(self.runner_id)
             return
-        input_num = ct.c_int(len(inputs))
         sg_inputs = (SGTensor*len(inputs))()
         inputs = [i if i.data.c_contiguous else np.ascontiguousarray(i) for i in inputs]
         for i in range(len(inputs)):
             sg_inputs[i].from_numpy(inputs[i])
-        task_id = self.__lib.runner_put_input(self.runner_id, input_num, sg_inputs, 1)
+        with self.__put_lock:
+            task_id = self.__lib.runner_put_input(self.runner_id, len(inputs), sg_inputs, 1)
         return task_id
+
+    def put_many(self, samples):
+        """
+        Put many samples in one native call. Each sample is a sequence of
+        input arrays. Returns list of task ids.
+        """
+        samples = [
+            [i if i.data.c_contiguous else np.ascontiguousarray(i) for i in sample]
+            for sample in samples]
+        if not samples:
+            return []
+        input_num = len(samples[0])
+        sg_inputs = (SGTensor*(input_num*len(samples)))()
+        for s, sample in enumerate(samples):
+            if len(sample) != input_num:
+                raise ValueError('samples should have the same number of inputs')
+            for i, data in enumerate(sample):
+                sg_inputs[s*input_num+i].from_numpy(data)
+        task_ids = (ct.c_uint32*len(samples))()
+        with self.__put_lock:
+            self.__lib.runner_put_inputs(
+                self.runner_id, len(samples), input_num, sg_inputs, 1, task_ids)
+        return list(task_ids)
+
+    def get_many(self, max_num, wait=True):
+        """
+        Fetch up to max_num outputs in one native call, see get for caveats.
+        """
+        return get_outputs(self.__lib, self.runner_id, max_num, wait, self.zero_copy)
         
     def get(self):
+        """
+        Low level output fetching, should not be mixed with submit, infer_one,
+        infer_all or infer_iter, whose outputs are routed by the dispatcher.
+        """
         return self.__get(self.__lib.runner_get_output)
 
     def try_get(self):
@@ -139,73 +428,41 @@ class SGInfer:
     def empty(self):
         return self.__lib.runner_empty(self.runner_id)
 
-    def infer_all(self, samples, key_func=None, out_func=None, in_func=None):
-        self.sample_count = len(samples)
-        if self.sample_count == 0:
-            return
-        self.map_lock = threading.Lock()
-        self.finish_cond = threading.Condition()
-        self.task_map = {}
-        self.sample_index = {}
-        self.out_func = out_func
-        self.wait_thread = threading.Thread(target=self.__wait_result)
-        self.wait_thread.start()
-        for i, sample in enumerate(samples):
-            sample_id = key_func(i, sample) if key_func else i
-            if in_func is not None:
-                sample = in_func(sample)
-            task_id = self.put(*sample)
-            self.map_lock.acquire()
-            self.sample_index[sample_id] = len(self.task_map)
-            self.task_map[task_id] = sample_id
-            self.map_lock.release()
-        self.wait_thread.join()
-        return self.final_outputs
-
-    def __wait_result(self):
-        cached_outputs = []
-        while self.sample_count>0:
-            task_id, outputs, valid = self.try_get()
-            if task_id == 0:
-                time.sleep(0.0001)
-                continue
-
-            self.map_lock.acquire()
-            sample_id = self.task_map[task_id]
-            del self.task_map[task_id]
-            self.map_lock.release()
-
-            if self.out_func is not None:
-                outputs = self.out_func(sample_id, outputs)
-            cached_outputs.append((sample_id, outputs))
-            self.sample_count -= 1
-
-        self.final_outputs = [None]*len(cached_outputs)
-        for id, out in cached_outputs:
-            self.final_outputs[self.sample_index[id]] = out
+    def __future(self, task_id):
+        if task_id == INVALID_TASK_ID:
+            raise RuntimeError(f'failed to put input to runner {self.runner_id}')
+        future = Future()
 
+        def callback(outputs, valid, error):
+            if not future.set_running_or_notify_cancel():
+                return
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result((outputs, valid))
 
-    def __get(self, func):
-        output_num= ct.c_uint32(0)
-        task_id = ct.c_uint32(0)
-        output_valid = ct.c_uint32(0)
-        func.restype = ct.POINTER(SGTensor)
-        output_tensors = func(self.runner_id, ct.byref(task_id), ct.byref(output_num), ct.byref(output_valid))
-        if(task_id.value == 0):
-            return 0, [], 0
-        outputs = []
-        if output_valid.value == 0:
-            return task_id.value, [], False
-        for i in range(output_num.value):
-            outputs.append(output_tensors[i].to_numpy())
-        self.__lib.runner_release_output(output_num, output_tensors)
-        return task_id.value, outputs, True
+        self.dispatcher.watch(task_id, callback)
+        return future
 
-    def infer_one(self, *inputs):
-        in_task_id = self.put(*inputs)
-        out_task_id, outputs, valid = self.get()
-        assert in_task_id == out_task_id
-        return outputs, valid
+    def submit(self, *inputs):
+        """
+        Put inputs to runner and return a concurrent.futures.Future of
+        (outputs, valid). Safe to call from many threads sharing one runner.
+        Raises RuntimeError if the runner rejects the input, e.g. after stop.
+        """
+        return self.__future(self.put(*inputs))
+
+    def submit_many(self, samples):
+        """
+        Like submit, but puts all samples in one native call.
+        """
+        task_ids = self.put_many(samples)
+        if INVALID_TASK_ID in task_ids:
+            raise RuntimeError(f'failed to put input to runner {self.runner_id}')
+        return [self.__future(task_id) for task_id in task_ids]
+
+    def __get(self, func):
+        return get_output(self.__lib, func, self.runner_id, self.zero_copy)
 
     def wait_to_stop(self):
         while not self.stopped():
@@ -214,16 +471,115 @@ class SGInfer:
 
     def get_durations(self):
         num = ct.c_uint32(0)
-        self.__lib.get_runner_durations.restype = ct.POINTER(ct.c_uint32)
         durations = self.__lib.get_runner_durations(self.runner_id, ct.byref(num))
         result = [durations[i] for i in range(num.value)]
         self.__lib.release_unsigned_pointer(durations);
         return result
 
+    def latency_stats(self, reset=False):
+        """
+        Latency percentiles in ms of each pipeline stage from the native
+        fixed memory histograms, and samples/sec of the current window.
+        If reset is set, a new window is started after reading.
+        """
+        max_num = 8
+        stats = (LatencyStats*max_num)()
+        qps = ct.c_double(0)
+        num = self.__lib.get_runner_latency_stats(
+            self.runner_id, stats, max_num, ct.byref(qps), reset)
+        stages = dict()
+        for s in stats[:num]:
+            stages[s.name.decode()] = dict(
+                count=s.count,
+                mean=s.mean / 1000,
+                min=s.min / 1000,
+                max=s.max / 1000,
+                p50=s.p50 / 1000,
+                p90=s.p90 / 1000,
+                p99=s.p99 / 1000,
+                p999=s.p999 / 1000)
+        return dict(qps=qps.value, stages=stages)
+
     def show(self):
         self.__lib.runner_show_status(self.runner_id)
 
 
+class AsyncSGInfer:
+    """
+    asyncio front-end of SGInfer. Inputs are submitted by one submitter
+    thread and results are resolved by the single SGDispatcher reader, so
+    any number of concurrent requests share one runner.
+    """
+    def __init__(self, bmodel_path, batch=1, devices=None, zero_copy=False):
+        self.runner = SGInfer(bmodel_path, batch, devices, zero_copy)
+        self.submitter = ThreadPoolExecutor(max_workers=1)
+
+    def __del__(self):
+        self.submitter.shutdown(wait=False)
+
+    async def submit(self, *inputs):
+        """
+        Put inputs to runner and return an asyncio future of (outputs, valid).
+        """
+        loop = asyncio.get_running_loop()
+        future = await loop.run_in_executor(self.submitter, self.runner.submit, *inputs)
+        return asyncio.wrap_future(future, loop=loop)
+
+    async def infer(self, *inputs):
+        return await (await self.submit(*inputs))
+
+    async def infer_stream(self, samples, window=16, ordered=True, key_func=None, in_func=None):
+        """
+        Async generator over (sample_id, outputs), keeping at most window
+        tasks in flight. Samples can be an iterable or an async iterable.
+        """
+        if window < 1:
+            raise ValueError('window should be positive')
+        pending = deque()
+        futures = dict()
+
+        async def collect():
+            if ordered:
+                sample_id, future = pending.popleft()
+                outputs, valid = await future
+                return [(sample_id, outputs)]
+            done, _ = await asyncio.wait(futures.keys(), return_when=asyncio.FIRST_COMPLETED)
+            results = []
+            for future in done:
+                outputs, valid = future.result()
+                results.append((futures.pop(future), outputs))
+            return results
+
+        def in_flight():
+            return len(pending) if ordered else len(futures)
+
+        async def iterate():
+            if hasattr(samples, '__aiter__'):
+                async for sample in samples:
+                    yield sample
+            else:
+                for sample in samples:
+                    yield sample
+
+        i = 0
+        async for sample in iterate():
+            while in_flight() >= window:
+                for result in await collect():
+                    yield result
+            sample_id = key_func(i, sample) if key_func else i
+            if in_func is not None:
+                sample = in_func(sample)
+            future = await self.submit(*sample)
+            if ordered:
+                pending.append((sample_id, future))
+            else:
+                futures[future] = sample_id
+            i += 1
+        while in_flight():
+            for result in await collect():
+                yield result
+
+
 if __name__ == "__main__":
 
     n = np.arange(1*3*2*2).astype(np.float32).reshape(1,3,2,2)
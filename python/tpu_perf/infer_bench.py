@@ -0,0 +1,157 @@
+import time
+import logging
+import argparse
+import threading
+import numpy as np
+from .infer import SGInfer, nptype
+from .logger import init_logger
+
+def make_inputs(infer):
+    inputs = []
+    for name, info in infer.get_input_info().items():
+        dtype = nptype(info['dtype'])
+        if dtype is None:
+            logging.error(f'Unsupported dtype {info["dtype"]} of input {name}')
+            raise RuntimeError('Invalid input')
+        inputs.append(np.zeros(info['shape'], dtype=dtype))
+    return inputs
+
+def percentile(values, p):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    index = min(len(values) - 1, int(len(values) * p / 100))
+    return values[index]
+
+def poll_collector(infer, count, done_times, cpu):
+    start = time.thread_time()
+    while count > 0:
+        task_id, _, _ = infer.try_get()
+        if task_id == 0:
+            time.sleep(0.0001)
+            continue
+        done_times[task_id] = time.perf_counter()
+        count -= 1
+    cpu.append(time.thread_time() - start)
+
+def block_collector(infer, count, done_times, cpu):
+    start = time.thread_time()
+    while count > 0:
+        task_id, _, _ = infer.get()
+        if task_id == 0:
+            break
+        done_times[task_id] = time.perf_counter()
+        count -= 1
+    cpu.append(time.thread_time() - start)
+
+collectors = dict(poll=poll_collector, block=block_collector)
+
+def bench_collector(infer, inputs, num, name):
+    """
+    Submit num tasks and collect them with the named collector.
+    Report collector cpu usage and per task latency.
+    """
+    put_times = dict()
+    done_times = dict()
+    cpu = []
+    collector = threading.Thread(
+        target=collectors[name], args=(infer, num, done_times, cpu))
+    start = time.perf_counter()
+    collector.start()
+    for _ in range(num):
+        task_id = infer.put(*inputs)
+        put_times[task_id] = time.perf_counter()
+    collector.join()
+    total = time.perf_counter() - start
+    latency = [
+        (done_times[k] - v) * 1000
+        for k, v in put_times.items() if k in done_times]
+    return dict(
+        collector=name,
+        samples=len(latency),
+        total_time=total,
+        qps=len(latency) / total,
+        collector_cpu=cpu[0] / total,
+        latency_mean=sum(latency) / len(latency) if latency else float('nan'),
+        latency_p50=percentile(latency, 50),
+        latency_p99=percentile(latency, 99))
+
+def bench_ffi(infer, inputs, num, chunk):
+    """
+    Round trip num tasks through single and bulk FFI entry points.
+    Results are fetched without the dispatcher.
+    """
+    results = []
+    start = time.perf_counter()
+    calls = 0
+    for _ in range(num):
+        infer.put(*inputs)
+        calls += 1
+    done = 0
+    while done < num:
+        task_id, _, _ = infer.get()
+        calls += 1
+        if task_id == 0:
+            break
+        done += 1
+    total = time.perf_counter() - start
+    results.append(dict(mode='single', tasks=done, calls=calls, total_time=total))
+
+    start = time.perf_counter()
+    calls = 0
+    for i in range(0, num, chunk):
+        infer.put_many([inputs] * min(chunk, num - i))
+        calls += 1
+    done = 0
+    while done < num:
+        outputs = infer.get_many(chunk)
+        calls += 1
+        if not outputs:
+            break
+        done += len(outputs)
+    total = time.perf_counter() - start
+    results.append(dict(mode=f'bulk{chunk}', tasks=done, calls=calls, total_time=total))
+    return results
+
+def show_ffi(stats):
+    logging.info(
+        f'{stats["mode"]:>8}: {stats["tasks"]} tasks, {stats["calls"]} calls in {stats["total_time"]:.3f}s, '
+        f'{stats["tasks"] / stats["total_time"]:.1f} tasks/s, '
+        f'{stats["calls"] / stats["total_time"]:.1f} calls/s')
+
+def show(stats):
+    logging.info(
+        f'{stats["collector"]:>6}: {stats["samples"]} samples in {stats["total_time"]:.3f}s, '
+        f'{stats["qps"]:.1f} samples/s, collector cpu {stats["collector_cpu"]:.2%}, '
+        f'latency mean {stats["latency_mean"]:.3f}ms '
+        f'p50 {stats["latency_p50"]:.3f}ms p99 {stats["latency_p99"]:.3f}ms')
+
+def main():
+    init_logger()
+    parser = argparse.ArgumentParser(description='SGInfer micro benchmark')
+    parser.add_argument('bmodel', type=str, help='bmodel path')
+    parser.add_argument('--num', '-n', type=int, default=1000, help='Number of tasks')
+    parser.add_argument('--devices', '-d', type=int, nargs='*', help='Devices')
+    parser.add_argument(
+        '--mode', type=str, default='collector', choices=['collector', 'ffi'],
+        help='Compare result collectors or single vs bulk FFI calls')
+    parser.add_argument(
+        '--collector', type=str, nargs='*', default=list(collectors.keys()),
+        choices=list(collectors.keys()), help='Result collectors to compare')
+    parser.add_argument('--chunk', type=int, default=64, help='Tasks per bulk FFI call')
+    args = parser.parse_args()
+
+    infer = SGInfer(args.bmodel, devices=args.devices)
+    inputs = make_inputs(infer)
+    # Warm up, results are collected without the dispatcher
+    infer.put(*inputs)
+    infer.get()
+    if args.mode == 'ffi':
+        for stats in bench_ffi(infer, inputs, args.num, args.chunk):
+            show_ffi(stats)
+        return
+    for name in args.collector:
+        show(bench_collector(infer, inputs, args.num, name))
+
+if __name__ == '__main__':
+    main()
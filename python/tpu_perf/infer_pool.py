@@ -0,0 +1,81 @@
+import time
+import threading
+from .infer import SGInfer, SGInferBase
+
+class SGInferPool(SGInferBase):
+    """
+    Load one bmodel on several devices, with one or more runners per device,
+    and dispatch each request to the runner with the fewest tasks in flight.
+    Ties are broken round robin, so equally loaded devices share the work.
+
+    infer_all and infer_iter keep results in submission order regardless of
+    which runner served them.
+    """
+    def __init__(self, bmodel_path, devices=None, runners_per_device=1, batch=1, zero_copy=False):
+        if devices is None:
+            devices = SGInfer.available_devices()
+        if not devices:
+            raise RuntimeError('no device found')
+        self.runners = []
+        self.devices = []
+        # Interleaved by device, so round robin alternates devices
+        for _ in range(runners_per_device):
+            for device in devices:
+                self.runners.append(SGInfer(bmodel_path, batch, (device,), zero_copy))
+                self.devices.append(device)
+        self.lock = threading.Lock()
+        self.next = 0
+        self.in_flight = [0] * len(self.runners)
+        self.completed = [0] * len(self.runners)
+        self.start_time = time.monotonic()
+
+    def __select(self):
+        least = min(self.in_flight)
+        num = len(self.runners)
+        for k in range(num):
+            index = (self.next + k) % num
+            if self.in_flight[index] == least:
+                self.next = index + 1
+                return index
+
+    def __finish(self, index, future):
+        with self.lock:
+            self.in_flight[index] -= 1
+            self.completed[index] += 1
+
+    def submit(self, *inputs):
+        with self.lock:
+            index = self.__select()
+            self.in_flight[index] += 1
+        try:
+            future = self.runners[index].submit(*inputs)
+        except BaseException:
+            with self.lock:
+                self.in_flight[index] -= 1
+            raise
+        future.add_done_callback(lambda f: self.__finish(index, f))
+        return future
+
+    def reset_stats(self):
+        with self.lock:
+            self.completed = [0] * len(self.runners)
+            self.start_time = time.monotonic()
+
+    def stats(self):
+        """
+        Aggregate and per device throughput since creation or last reset.
+        """
+        with self.lock:
+            elapsed = time.monotonic() - self.start_time
+            completed = list(self.completed)
+            in_flight = list(self.in_flight)
+        per_device = dict()
+        for device, n in zip(self.devices, completed):
+            per_device[device] = per_device.get(device, 0) + n
+        total = sum(completed)
+        return dict(
+            samples=total,
+            elapsed=elapsed,
+            qps=total / elapsed if elapsed > 0 else 0,
+            in_flight=sum(in_flight),
+            device_samples=per_device)
@@ -1,5 +1,19 @@
+import os
+import zlib
+import hashlib
+import functools
+import itertools
+import contextlib
+import time
+import queue
+import logging
+import weakref
+import threading
 import numpy as np
-from collections import Iterable
+import yaml
+import ctypes as ct
+from collections.abc import Iterable
+from concurrent.futures import ProcessPoolExecutor
 import lmdb
 try:
     from scipy.ndimage import zoom
@@ -7,10 +21,95 @@ try:
     import skimage.io
 except:
     pass
+try:
+    import lz4.block
+except ImportError:
+    lz4 = None
 
 from . import blob_pb2 as ufw_blob
 
 
+## Preprocess stats
+_stats = dict()
+_stats_lock = threading.Lock()
+_stage_local = threading.local()
+_progress = None
+
+
+def add_stats(stats):
+    """
+    Accumulates stats of this process, e.g. of worker processes. Values
+    of peak_ keys are maxed, others are summed.
+    """
+    with _stats_lock:
+        for k, v in stats.items():
+            if k.startswith('peak_'):
+                _stats[k] = max(_stats.get(k, v), v)
+            else:
+                _stats[k] = _stats.get(k, 0) + v
+
+
+def take_stats():
+    """
+    Returns and resets stats accumulated in this process.
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+        _stats.clear()
+    return stats
+
+
+@contextlib.contextmanager
+def timed(stage):
+    """
+    Adds time spent in the block, or the decorated function, to stats
+    stage + '_time'. Image loading is timed as decode, and Transformer,
+    resize and oversample as transform. Preprocess plugins can mark
+    their own decode and transform code this way. Only the outermost
+    block of a stage in a thread counts, so nested blocks of the same
+    stage are not counted twice.
+    """
+    depths = getattr(_stage_local, 'depths', None)
+    if depths is None:
+        depths = _stage_local.depths = dict()
+    depth = depths.get(stage, 0)
+    depths[stage] = depth + 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        depths[stage] = depth
+        if depth == 0:
+            add_stats({f'{stage}_time': time.perf_counter() - start})
+
+
+def set_progress_counter(counter):
+    """
+    Set a multiprocessing.Value which dataset writers of this process
+    add samples to, for progress across processes.
+    """
+    global _progress
+    _progress = counter
+
+
+def progress_counter():
+    return _progress
+
+
+def _count_samples(num, new=True):
+    """
+    Counts samples written, and new_samples which were preprocessed
+    rather than copied.
+    """
+    if not new:
+        add_stats(dict(samples=num))
+        return
+    add_stats(dict(samples=num, new_samples=num))
+    if _progress is not None:
+        with _progress.get_lock():
+            _progress.value += num
+
+
 ## proto / datum / ndarray conversion
 def blobproto_to_array(blob, return_diff=False):
     """
@@ -20,6 +119,8 @@ def blobproto_to_array(blob, return_diff=False):
     # Read the data into an array
     if return_diff:
         data = np.array(blob.diff)
+    elif blob.HasField('raw_data'):
+        data = np.frombuffer(blob.raw_data, dtype=np_dtype[blob.dtype])
     else:
         data = np.array(blob.data)
 
@@ -47,20 +148,28 @@ ufw_dtype = {np.dtype(k): v for k, v in dtype_dict.items()}
 np_dtype = {v: k for k, v in dtype_dict.items()}
 
 
-def array_to_blobproto(arr):
+def array_to_blobproto(arr, raw=False):
     """Converts a N-dimensional array to blob proto. If diff is given, also
     convert the diff. You need to make sure that arr and diff have the same
     shape, and this function does not do sanity check.
+
+    If raw is True, data is stored as bytes of its native dtype in raw_data,
+    which avoids per element conversion. Readers unaware of raw_data
+    should use the default legacy fields.
     """
     blob = ufw_blob.BlobProto()
     blob.shape.dim.extend(arr.shape)
+    if raw and arr.dtype in ufw_dtype:
+        blob.dtype = ufw_dtype[arr.dtype]
+        blob.raw_data = np.ascontiguousarray(arr).tobytes()
+        return blob
     blob.dtype = ufw_dtype[arr.dtype]
     if arr.dtype in (
             np.float32,
             np.float16,
             np.float64,
     ):
-        blob.data.extend(arr.astype(np.float32).flat)
+        blob.data.extend(arr.astype(np.float32).ravel().tolist())
         return blob
     if arr.dtype in (
             np.uint32,
@@ -70,17 +179,17 @@ def array_to_blobproto(arr):
             np.int16,
             np.uint16,
     ):
-        blob.int32_data.extend(arr.astype(np.int32).flat)
+        blob.int32_data.extend(arr.astype(np.int32).ravel().tolist())
         return blob
     raise Exception("unsupported numpy dtype:{}".format(arr.dtype))
 
 
-def arraylist_to_blobprotovector_str(arraylist):
+def arraylist_to_blobprotovector_str(arraylist, raw=False):
     """Converts a list of arrays to a serialized blobprotovec, which could be
     then passed to a network for processing.
     """
     vec = ufw_blob.BlobProtoVector()
-    vec.blobs.extend([array_to_blobproto(arr) for arr in arraylist])
+    vec.blobs.extend([array_to_blobproto(arr, raw) for arr in arraylist])
     return vec.SerializeToString()
 
 
@@ -92,22 +201,73 @@ def blobprotovector_str_to_arraylist(str):
     return [blobproto_to_array(blob) for blob in vec.blobs]
 
 
-def array_to_datum(arr, label=None):
+datum_codecs = dict(zlib=ufw_blob.Datum.ZLIB, lz4=ufw_blob.Datum.LZ4)
+
+
+def _compress(data, compress):
+    if compress == 'zlib':
+        return zlib.compress(data, 1)
+    if compress == 'lz4':
+        if lz4 is None:
+            raise RuntimeError('lz4 compression needs the lz4 package')
+        return lz4.block.compress(data, store_size=True)
+    raise ValueError(f'Unknown compression {compress}')
+
+
+def _decompress(data, codec):
+    if codec == ufw_blob.Datum.ZLIB:
+        return zlib.decompress(data)
+    if codec == ufw_blob.Datum.LZ4:
+        if lz4 is None:
+            raise RuntimeError('lz4 compressed datum needs the lz4 package')
+        return lz4.block.decompress(data)
+    return data
+
+
+def array_to_datum(arr, label=None, encoding='legacy', compress=None):
     """
     Converts a arbitrary-dimensional and arbitrary-dtype array to datum.
+
+    encoding is one of
+    - legacy: float32 as float_data, other dtypes as raw bytes
+    - raw: raw bytes of the native dtype
+    - uint8: integer valued arrays in [0, 255] as bytes, read back as
+      the original dtype
+    compress is None, 'zlib' or 'lz4', and is applied to the bytes.
     """
     datum = ufw_blob.Datum()
     datum.shape.dim.extend(arr.shape)
-    if arr.dtype == np.float32:
-        datum.float_data.extend(arr.flat)
-    else:
-        datum.data = arr.view(np.uint8).tostring()
     datum.dtype = ufw_dtype[arr.dtype]
     if label is not None:
         datum.label = label
+    if encoding == 'legacy' and compress is None and arr.dtype == np.float32:
+        datum.float_data.extend(arr.ravel().tolist())
+        return datum
+    if encoding == 'uint8' and arr.dtype != np.uint8:
+        stored = arr.astype(np.uint8)
+        if not np.array_equal(stored, arr):
+            raise ValueError('uint8 encoding needs integer values in [0, 255]')
+        arr = stored
+        datum.storage_dtype = ufw_dtype[arr.dtype]
+    elif encoding not in ('legacy', 'raw', 'uint8'):
+        raise ValueError(f'Unknown datum encoding {encoding}')
+    data = arr.tobytes()
+    if compress is not None:
+        data = _compress(data, compress)
+        datum.codec = datum_codecs[compress]
+    datum.data = data
     return datum
 
 
+def _decode_data(datum, data, shape):
+    data = _decompress(data, datum.codec)
+    dtype = np_dtype[datum.dtype]
+    if datum.HasField('storage_dtype'):
+        return np.frombuffer(
+            data, dtype=np_dtype[datum.storage_dtype]).astype(dtype).reshape(shape)
+    return np.frombuffer(data, dtype=dtype).reshape(shape)
+
+
 def datum_to_array(datum):
     """Converts a datum to an array. Note that the label is not returned,
     as one can easily get it by calling datum.label.
@@ -117,10 +277,92 @@ def datum_to_array(datum):
     else:
         shape = [datum.channels, datum.height, datum.width]
     if len(datum.data):
-        return np.fromstring(datum.data, dtype=np.uint8).view(
-            np_dtype[datum.dtype]).reshape(shape)
+        return _decode_data(datum, datum.data, shape)
     else:
-        return np.array(datum.float_data).astype(np.float32).reshape(shape)
+        return np.array(datum.float_data, dtype=np.float32).reshape(shape)
+
+
+def _read_varint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+DATUM_DATA_FIELD = ufw_blob.Datum.DESCRIPTOR.fields_by_name['data'].number
+DATUM_FLOAT_DATA_FIELD = ufw_blob.Datum.DESCRIPTOR.fields_by_name['float_data'].number
+
+
+def _split_datum(view):
+    """Locate the data field in a serialized datum.
+    Returns the serialized datum without data, and offset and size of data,
+    or None if there is no data field. Scanning stops at the first
+    float_data element, which follows data, so legacy float datums are
+    not walked element by element.
+    """
+    pos = 0
+    end = len(view)
+    while pos < end:
+        start = pos
+        tag, pos = _read_varint(view, pos)
+        if tag >> 3 == DATUM_FLOAT_DATA_FIELD:
+            return None
+        wire = tag & 7
+        if wire == 0:
+            _, pos = _read_varint(view, pos)
+        elif wire == 1:
+            pos += 8
+        elif wire == 2:
+            size, pos = _read_varint(view, pos)
+            if tag >> 3 == DATUM_DATA_FIELD:
+                rest = bytes(view[:start]) + bytes(view[pos + size:])
+                return rest, pos, size
+            pos += size
+        elif wire == 5:
+            pos += 4
+        else:
+            return None
+    return None
+
+
+def parse_datum(value, copy=False, owner=None):
+    """Parses a serialized datum and returns (datum, array).
+
+    The datum has no data field, and the array is a view into value
+    unless copy is True. If owner is given, the view keeps a reference to
+    it, e.g. the transaction value belongs to. Only plain byte payloads
+    can be viewed, float_data and encoded payloads are always decoded
+    into new arrays.
+    """
+    view = memoryview(value)
+    split = _split_datum(view)
+    datum = ufw_blob.Datum()
+    if split is None or split[2] == 0:
+        datum.ParseFromString(view)
+        return datum, datum_to_array(datum)
+    rest, offset, size = split
+    datum.ParseFromString(rest)
+    if datum.HasField('shape'):
+        shape = datum.shape.dim
+    else:
+        shape = [datum.channels, datum.height, datum.width]
+    if datum.codec != ufw_blob.Datum.NONE or datum.HasField('storage_dtype'):
+        return datum, _decode_data(datum, view[offset:offset + size], shape)
+    dtype = np.dtype(np_dtype[datum.dtype])
+    arr = np.frombuffer(view, dtype=np.uint8, count=size, offset=offset)
+    if copy:
+        arr = arr.copy()
+    elif owner is not None:
+        buffer = (ct.c_byte * size).from_address(arr.ctypes.data)
+        buffer._owner = owner
+        arr = np.frombuffer(buffer, dtype=np.uint8)
+        arr.flags.writeable = False
+    return datum, arr.view(dtype).reshape(shape)
 
 
 def blob_to_array(Input):
@@ -145,8 +387,11 @@ def blob_to_array(Input):
                 "Expected a scalar, but got an array with length {}".format(
                     lenData))
         if lenData > 0:
-            return np.array(data).astype(dtype).reshape(shape)
+            return np.array(data, dtype=dtype).reshape(shape)
 
+    if blob.HasField('raw_data'):
+        return np.frombuffer(
+            blob.raw_data, dtype=np_dtype[blob.dtype]).reshape(shape)
     if len(blob.data) > 0:
         return toArray(blob.data, np.float32)
     if len(blob.int32_data) > 0:
@@ -174,12 +419,36 @@ class Transformer:
         self.raw_scale = {}
         self.mean = {}
         self.input_scale = {}
+        self.affine = {}
 
     def __check_input(self, in_):
         if in_ not in self.inputs:
             raise Exception('{} is not one of the net inputs: {}'.format(
                 in_, self.inputs))
 
+    def __update_affine(self, in_):
+        """
+        Fold raw_scale, mean and input_scale into the scale and bias used
+        by preprocess_batch:
+        ((x * raw_scale) - mean) * input_scale = x * scale + bias
+        """
+        raw_scale = self.raw_scale.get(in_)
+        mean = self.mean.get(in_)
+        input_scale = self.input_scale.get(in_)
+        scale = np.float32(1)
+        if raw_scale is not None:
+            scale = scale * raw_scale
+        if input_scale is not None:
+            scale = scale * input_scale
+        bias = None
+        if mean is not None:
+            bias = -np.asarray(mean, dtype=np.float32)
+            if input_scale is not None:
+                bias = bias * input_scale
+            bias = bias.astype(np.float32, copy=False)
+        self.affine[in_] = (np.asarray(scale, dtype=np.float32), bias)
+
+    @timed('transform')
     def preprocess(self, in_, data):
         """
         Format input for Caffe:
@@ -222,6 +491,63 @@ class Transformer:
             ufw_in *= input_scale
         return ufw_in
 
+    @timed('transform')
+    def preprocess_batch(self, in_, batch, out=None, fast_resize=False):
+        """
+        Format a batch for Caffe, same as preprocess() on each image.
+
+        raw_scale, mean and input_scale are folded into one scale and
+        bias when they are set, which are applied to the whole batch at
+        once straight from the transposed and channel swapped view of the
+        input. No full size temporaries are made, unless a channel swap
+        which is not a strided slice, e.g. (1, 0, 2), has to be gathered.
+
+        Images are resized by resize_image as in preprocess(), unless
+        fast_resize is set, which resizes the whole batch by
+        resize_images. That is faster but clamps edges and does not
+        anti-alias, so the result is close to but not the same as
+        preprocess().
+
+        Parameters
+        ----------
+        in_ : name of input blob to preprocess for
+        batch : (N x H' x W' x K) ndarray of any dtype
+        out : optional C contiguous float32 (N x K x H x W) ndarray to
+            write into, which can be passed to SGInfer.put as is
+        fast_resize : resize by resize_images instead of resize_image
+
+        Returns
+        -------
+        out : (N x K x H x W) ndarray
+        """
+        self.__check_input(in_)
+        transpose = self.transpose.get(in_)
+        channel_swap = self.channel_swap.get(in_)
+        scale, bias = self.affine.get(in_, (np.float32(1), None))
+        in_dims = tuple(self.inputs[in_][2:])
+        if batch.shape[1:3] != in_dims:
+            if fast_resize:
+                batch = resize_images(batch, in_dims)
+            else:
+                batch = np.stack([
+                    resize_image(im.astype(np.float32, copy=False), in_dims)
+                    for im in batch])
+        if transpose is not None:
+            batch = batch.transpose((0, ) + tuple(t + 1 for t in transpose))
+        if channel_swap is not None:
+            batch = batch[:, _channel_index(channel_swap)]
+        if out is None:
+            out = np.empty(batch.shape, dtype=np.float32)
+        elif out.shape != batch.shape or out.dtype != np.float32 \
+                or not out.flags.c_contiguous:
+            raise ValueError(
+                f'Output buffer must be C contiguous float32 of shape {batch.shape}')
+
+        np.multiply(batch, scale, out=out)
+        if bias is not None:
+            out += bias
+        return out
+
     def deprocess(self, in_, data):
         """
         Invert Caffe formatting; see preprocess().
@@ -294,6 +620,7 @@ class Transformer:
         """
         self.__check_input(in_)
         self.raw_scale[in_] = scale
+        self.__update_affine(in_)
 
     def set_mean(self, in_, mean):
         """
@@ -325,6 +652,7 @@ class Transformer:
                         in_shape[1:]).transpose((2,0,1)) * \
                         (m_max - m_min) + m_min
         self.mean[in_] = mean
+        self.__update_affine(in_)
 
     def set_input_scale(self, in_, scale):
         """
@@ -339,11 +667,41 @@ class Transformer:
         """
         self.__check_input(in_)
         self.input_scale[in_] = scale
+        self.__update_affine(in_)
+
+
+def _channel_index(order):
+    """
+    Index taking channels in order, as a slice, so a view, when order is
+    evenly spaced like (2, 1, 0).
+    """
+    order = [int(k) for k in order]
+    step = order[1] - order[0] if len(order) > 1 else 1
+    if step == 0 or any(b - a != step for a, b in zip(order, order[1:])):
+        return order
+    stop = order[-1] + step
+    return slice(order[0], stop if stop >= 0 else None, step)
 
 
 ## Image IO
 
 
+def _read_image(filename, color=True):
+    return skimage.io.imread(filename, as_grey=not color)
+
+
+def _image_to_float(img, color=True):
+    img = skimage.img_as_float(img).astype(np.float32)
+    if img.ndim == 2:
+        img = img[:, :, np.newaxis]
+        if color:
+            img = np.tile(img, (1, 1, 3))
+    elif img.shape[2] == 4:
+        img = img[:, :, :3]
+    return img
+
+
+@timed('decode')
 def load_image(filename, color=True):
     """
     Load an image converting from grayscale or alpha as needed.
@@ -361,17 +719,105 @@ def load_image(filename, color=True):
         of size (H x W x 3) in RGB or
         of size (H x W x 1) in grayscale.
     """
-    img = skimage.img_as_float(skimage.io.imread(
-        filename, as_grey=not color)).astype(np.float32)
-    if img.ndim == 2:
-        img = img[:, :, np.newaxis]
-        if color:
-            img = np.tile(img, (1, 1, 3))
-    elif img.shape[2] == 4:
-        img = img[:, :, :3]
-    return img
+    return _image_to_float(_read_image(filename, color), color)
+
+
+def _image_cache_path(cache_dir, filename, color):
+    stat = os.stat(filename)
+    key = f'{os.path.abspath(filename)}|{stat.st_mtime_ns}|{stat.st_size}|{color}'
+    return os.path.join(cache_dir, hashlib.md5(key.encode()).hexdigest() + '.npy')
+
+
+def _save_cached_image(path, img):
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        np.save(f, img)
+    os.replace(tmp, path)
+
 
+def _trim_image_cache(cache_dir, cache_size):
+    """
+    Remove least recently used entries until the cache fits cache_size
+    bytes. Hits refresh the mtime of entries.
+    """
+    entries = []
+    total = 0
+    for entry in os.scandir(cache_dir):
+        if not entry.name.endswith('.npy'):
+            continue
+        stat = entry.stat()
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total += stat.st_size
+    entries.sort()
+    for _, size, path in entries:
+        if total <= cache_size:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+@timed('decode')
+def load_images(filenames, color=True, workers=None, cache_dir=None,
+                cache_size=10 * 1024 ** 3):
+    """
+    Load images like load_image, decoding in a pool of worker processes.
+
+    If cache_dir is given, decoded images are kept there as .npy files
+    keyed by path, mtime, size and color, and later loads memory map them
+    instead of decoding. The cache is trimmed to cache_size bytes in
+    least recently used order.
+
+    Parameters
+    ----------
+    filenames : list of strings
+    color : see load_image
+    workers : number of decode processes, default is the number of cpus,
+        and 0 or 1 decodes in this process.
+    cache_dir : optional directory of the decoded image cache
+    cache_size : cap of the cache in bytes
 
+    Returns
+    -------
+    images : list of images as returned by load_image
+    """
+    filenames = list(filenames)
+    decoded = [None] * len(filenames)
+    cache_paths = [None] * len(filenames)
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        for i, fn in enumerate(filenames):
+            path = _image_cache_path(cache_dir, fn, color)
+            cache_paths[i] = path
+            try:
+                decoded[i] = np.load(path, mmap_mode='r')
+                os.utime(path)
+            except (FileNotFoundError, ValueError):
+                pass
+    missing = [i for i, img in enumerate(decoded) if img is None]
+    if workers is None:
+        workers = os.cpu_count()
+    if workers > 1 and len(missing) > 1:
+        with ProcessPoolExecutor(min(workers, len(missing))) as executor:
+            images = executor.map(
+                _read_image, [filenames[i] for i in missing],
+                [color] * len(missing),
+                chunksize=max(1, len(missing) // (workers * 4)))
+            for i, img in zip(missing, images):
+                decoded[i] = img
+    else:
+        for i in missing:
+            decoded[i] = _read_image(filenames[i], color)
+    if cache_dir is not None:
+        for i in missing:
+            _save_cached_image(cache_paths[i], decoded[i])
+        _trim_image_cache(cache_dir, cache_size)
+    return [_image_to_float(img, color) for img in decoded]
+
+
+@timed('transform')
 def resize_image(im, new_dims, interp_order=1):
     """
     Resize an image array with interpolation.
@@ -410,125 +856,371 @@ def resize_image(im, new_dims, interp_order=1):
     return resized_im.astype(np.float32)
 
 
-def oversample(images, crop_dims):
+@functools.lru_cache(maxsize=64)
+def _linear_plan(src, dst):
+    """
+    Source indices and weights of bilinear interpolation along one axis,
+    with pixel centers aligned and edges clamped.
+    """
+    x = (np.arange(dst) + 0.5) * (src / dst) - 0.5
+    x = np.clip(x, 0, src - 1)
+    i0 = np.floor(x).astype(np.intp)
+    i1 = np.minimum(i0 + 1, src - 1)
+    w = (x - i0).astype(np.float32)
+    return i0, i1, w
+
+
+@timed('transform')
+def resize_images(ims, new_dims):
+    """
+    Bilinear resize of images, a fast path for resize_image.
+
+    Interpolation tables are cached per shape pair and applied to the
+    whole batch at once. Edges are clamped and there is no anti-aliasing,
+    so results differ slightly from resize_image, which stays the
+    reference.
+
+    Parameters
+    ----------
+    ims : (N x H x W x K) or (H x W x K) ndarray of any dtype
+    new_dims : (height, width) tuple of new dimensions.
+
+    Returns
+    -------
+    ims : float32 ndarray of shape (N x new_dims[0] x new_dims[1] x K),
+        or (new_dims[0] x new_dims[1] x K)
+    """
+    ims = np.asarray(ims)
+    if ims.ndim == 3:
+        return resize_images(ims[np.newaxis], new_dims)[0]
+    h0, h1, hw = _linear_plan(ims.shape[1], int(new_dims[0]))
+    w0, w1, ww = _linear_plan(ims.shape[2], int(new_dims[1]))
+    hw = hw[:, np.newaxis, np.newaxis]
+    ww = ww[:, np.newaxis]
+    rows = ims[:, h0].astype(np.float32)
+    bottom = ims[:, h1].astype(np.float32)
+    bottom -= rows
+    bottom *= hw
+    rows += bottom
+    out = rows[:, :, w0]
+    right = rows[:, :, w1]
+    right -= out
+    right *= ww
+    out += right
+    return out
+
+
+@timed('transform')
+def oversample(images, crop_dims, center_only=False):
     """
     Crop images into the four corners, center, and their mirrored versions.
 
     Parameters
     ----------
-    image : iterable of (H x W x K) ndarrays
+    image : (N x H x W x K) ndarray or iterable of (H x W x K) ndarrays
     crop_dims : (height, width) tuple for the crops.
+    center_only : only take the center crop, as a view of images if
+        they are an ndarray.
 
     Returns
     -------
-    crops : (10*N x H x W x K) ndarray of crops for number of inputs N.
-    """
-    # Dimensions and center.
-    im_shape = np.array(images[0].shape)
-    crop_dims = np.array(crop_dims)
-    im_center = im_shape[:2] / 2.0
-
-    # Make crop coordinates
-    h_indices = (0, im_shape[0] - crop_dims[0])
-    w_indices = (0, im_shape[1] - crop_dims[1])
-    crops_ix = np.empty((5, 4), dtype=int)
-    curr = 0
-    for i in h_indices:
-        for j in w_indices:
-            crops_ix[curr] = (i, j, i + crop_dims[0], j + crop_dims[1])
-            curr += 1
-    crops_ix[4] = np.tile(im_center, (1, 2)) + np.concatenate(
-        [-crop_dims / 2.0, crop_dims / 2.0])
-    crops_ix = np.tile(crops_ix, (2, 1))
-
-    # Extract crops
-    crops = np.empty(
-        (10 * len(images), crop_dims[0], crop_dims[1], im_shape[-1]),
-        dtype=np.float32)
-    ix = 0
-    for im in images:
-        for crop in crops_ix:
-            crops[ix] = im[crop[0]:crop[2], crop[1]:crop[3], :]
-            ix += 1
-        crops[ix - 5:ix] = crops[ix - 5:ix, :, ::-1, :]  # flip for mirrors
-    return crops
+    crops : (10*N x H x W x K) ndarray of crops for number of inputs N,
+        or (N x H x W x K) of center crops.
+    """
+    images = np.asarray(images)
+    n, height, width, channels = images.shape
+    crop_h, crop_w = (int(d) for d in crop_dims)
+    center = (int(height / 2.0 - crop_h / 2.0), int(width / 2.0 - crop_w / 2.0))
+    if center_only:
+        return images[:, center[0]:center[0] + crop_h, center[1]:center[1] + crop_w]
+
+    # Corners then center, each taken from all images at once
+    origins = [
+        (i, j) for i in (0, height - crop_h) for j in (0, width - crop_w)]
+    origins.append(center)
+    crops = np.empty((n, 10, crop_h, crop_w, channels), dtype=np.float32)
+    for k, (i, j) in enumerate(origins):
+        crop = images[:, i:i + crop_h, j:j + crop_w]
+        crops[:, k] = crop
+        crops[:, k + 5] = crop[:, :, ::-1]  # flip for mirrors
+    return crops.reshape((10 * n, crop_h, crop_w, channels))
+
+
+def _put_args(images, labels, keys, index, key_format):
+    """
+    Normalizes arguments of dataset put() to lists of images, labels and
+    encoded keys.
+    """
+    if isinstance(images, np.ndarray):
+        images = [images]
+
+    if isinstance(keys, str):
+        keys = [keys]
+
+    num = len(images)
+    if keys is None:
+        keys = [''] * num
+    assert (num == len(keys))
+    keys = [
+        key_format.format(index + i, k).encode()
+        for i, k in enumerate(keys)
+    ]
+
+    if isinstance(labels, Iterable):
+        labels = [labels[i] for i in range(num)]
+    if labels is None:
+        labels = [None] * num
+    elif isinstance(labels, int):
+        labels = [labels]
+    return images, labels, keys
 
 
 class LMDB_Dataset(object):
-    def __init__(self, path, queue_size=100, map_size=20e6):
+    """
+    Writes arrays as datums with dense index keys.
+
+    Batches of queue_size samples are committed by a background writer
+    thread, at most pending batches behind the producer. The map is grown
+    ahead of each commit from the space used so far, and to the predicted
+    final size if the expected sample count is given, so commits rarely
+    hit MapFullError.
+
+    encoding and compress select how datums are stored, see
+    array_to_datum. Readers decode any of them transparently.
+    """
+    def __init__(self, path, queue_size=100, map_size=20e6, count=None, pending=4,
+                 encoding='legacy', compress=None):
+        if encoding not in ('legacy', 'raw', 'uint8'):
+            raise ValueError(f'Unknown datum encoding {encoding}')
+        if compress is not None and compress not in datum_codecs:
+            raise ValueError(f'Unknown compression {compress}')
+        if compress == 'lz4' and lz4 is None:
+            raise RuntimeError('lz4 compression needs the lz4 package')
         self.db = lmdb.open(path,
-                            map_size,
+                            int(map_size),
                             create=True,
                             lock=False,
                             map_async=True,
                             max_dbs=0)
-        self.txn = self.db.begin(write=True)
         self.DB_KEY_FORMAT = "{:0>10d}__{:1}"
         self.queue_size = queue_size
+        self.count = count
+        self.encoding = encoding
+        self.compress = compress
         self.index = 0
+        self.input_ends = []
         self.value_list = []
         self.key_list = []
+        self.written = 0
+        self.bytes = 0
+        self.write_time = 0
+        self.commit_time = 0
+        self.commit_wait = 0
+        self.error = None
+        self.start_time = time.perf_counter()
+        self.queue = queue.Queue(pending)
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
 
     def put(self, images, labels=None, keys=None):
-        if isinstance(images, np.ndarray):
-            images = [images]
-
-        if isinstance(keys, str):
-            keys = [keys]
-
-        num = len(images)
-        if keys is None:
-            keys = [''] * num
-        assert (num == len(keys))
-        keys = [
-            self.DB_KEY_FORMAT.format(self.index + i, k)
-            for i, k in enumerate(keys)
+        _count_samples(self._put(images, labels, keys))
+
+    def _put(self, images, labels, keys):
+        start = time.perf_counter()
+        images, labels, keys = _put_args(
+            images, labels, keys, self.index, self.DB_KEY_FORMAT)
+        # Encode all first, a failed datum leaves the pending batch intact
+        values = [
+            array_to_datum(g, l, self.encoding, self.compress).SerializeToString()
+            for g, l in zip(images, labels)
         ]
+        self.key_list.extend(keys)
+        self.value_list.extend(values)
+        self.index += len(images)
+        self.write_time += time.perf_counter() - start
+        if len(self.key_list) >= self.queue_size:
+            self._put_batch()
+        return len(images)
 
-        def put_datum(arr, labels):
-            num = len(arr)
-            if isinstance(labels, Iterable):
-                labels = [labels[i] for i in range(num)]
-            if labels is None:
-                labels = [None] * num
-            elif isinstance(labels, int):
-                labels = [labels]
-            return [
-                array_to_datum(g, l).SerializeToString()
-                for g, l in zip(arr, labels)
-            ]
+    def input_done(self):
+        """
+        Marks the samples put so far as those of the inputs done, called
+        by sharded plugins after each input, see preprocess_method.
+        """
+        self.input_ends.append(self.index)
 
+    def put_datums(self, values, keys):
+        """
+        Put serialized datums under encoded keys as they are, e.g. to merge
+        databases. Keys must be in increasing order.
+        """
         self.key_list.extend(keys)
-        self.value_list.extend(put_datum(images, labels))
-        self.index += num
+        self.value_list.extend(values)
+        self.index += len(values)
         if len(self.key_list) >= self.queue_size:
             self._put_batch()
 
+    def _check_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
     def _put_batch(self):
+        self._check_error()
         if len(self.key_list) == 0:
             return
-        for key, value in zip(self.key_list, self.value_list):
-            if not self._put(key, value):
-                self._put_batch()
-        self.txn.commit()
-        self.txn = self.db.begin(write=True)
+        start = time.perf_counter()
+        self.queue.put((self.key_list, self.value_list))
+        # Producer stalled on commits
+        self.commit_wait += time.perf_counter() - start
         self.value_list = []
         self.key_list = []
 
-    def _put(self, key, value):
-        success = False
+    def _write_loop(self):
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                break
+            if self.error is not None:
+                continue
+            try:
+                start = time.perf_counter()
+                self._commit(*batch)
+                self.commit_time += time.perf_counter() - start
+            except Exception as err:
+                self.error = err
+
+    def _used_size(self):
+        return (self.db.info()['last_pgno'] + 1) * self.db.stat()['psize']
+
+    def _reserve(self, size):
+        used = self._used_size()
+        # Leaves and overflow pages take more than the payload
+        target = used + size * 2
+        if self.count and self.written:
+            target = max(target, int(used / self.written * self.count * 1.1))
+        map_size = self.db.info()['map_size']
+        if target > map_size:
+            self.db.set_mapsize(max(target, map_size * 2))
+
+    def _commit(self, keys, values):
+        size = sum(len(k) + len(v) for k, v in zip(keys, values))
+        self._reserve(size)
+        while True:
+            try:
+                with self.db.begin(write=True) as txn:
+                    for key, value in zip(keys, values):
+                        txn.put(key, value, append=True)
+                break
+            except lmdb.MapFullError:
+                self.db.set_mapsize(self.db.info()['map_size'] * 2)
+        self.written += len(keys)
+        self.bytes += size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if getattr(self, 'writer', None) is None:
+            return
         try:
-            if isinstance(key, str):
-                key = key.encode()
-            self.txn.put(key, value, append=True)
-            success = True
-        except lmdb.MapFullError:
-            self.txn.abort()
-            curr_limit = self.db.info()['map_size']
-            new_limit = curr_limit * 2
-            self.db.set_mapsize(new_limit)
-            self.txn = self.db.begin(write=True)
-        return success
+            self._put_batch()
+        finally:
+            self.queue.put(None)
+            self.writer.join()
+            self.writer = None
+            self.db.close()
+        elapsed = time.perf_counter() - self.start_time
+        mb = self.bytes / 1e6
+        logging.info(
+            f'Wrote {self.written} samples, {mb:.1f}MB in {elapsed:.2f}s, '
+            f'{mb / elapsed:.1f}MB/s, committing {self.commit_time:.2f}s')
+        add_stats(dict(
+            bytes=self.bytes, write_time=self.write_time,
+            commit_time=self.commit_time, commit_wait_time=self.commit_wait))
+        self._check_error()
+
+    def __del__(self):
+        self.close()
+
+
+NPY_INDEX = 'index.yaml'
+
+
+class NpyDataset(object):
+    """
+    Writes fixed shape arrays into memory mappable .npy shards.
+
+    Shards hold shard_size samples each, the last one may hold fewer.
+    Labels and keys go to labels.npy and keys.npy, and index.yaml is
+    written on close, so a dataset without it is incomplete. The put()
+    interface is the same as LMDB_Dataset.
+    """
+    def __init__(self, path, shard_size=1024):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.DB_KEY_FORMAT = "{:0>10d}__{:1}"
+        self.shard_size = shard_size
+        self.index = 0
+        self.input_ends = []
+        self.buffer = None
+        self.fill = 0
+        self.shards = []
+        self.labels = []
+        self.keys = []
+        self.bytes = 0
+        self.write_time = 0
+        self.commit_time = 0
+        self.closed = False
+
+    def put(self, images, labels=None, keys=None):
+        _count_samples(self._put(images, labels, keys))
+
+    def _put(self, images, labels, keys):
+        start = time.perf_counter()
+        images, labels, keys = _put_args(
+            images, labels, keys, self.index, self.DB_KEY_FORMAT)
+        for arr in images:
+            arr = np.asarray(arr)
+            if self.buffer is None:
+                self.buffer = np.empty(
+                    (self.shard_size, ) + arr.shape, dtype=arr.dtype)
+            elif arr.shape != self.buffer.shape[1:] or arr.dtype != self.buffer.dtype:
+                raise ValueError(
+                    f'npy dataset needs fixed shape {self.buffer.shape[1:]} '
+                    f'and dtype {self.buffer.dtype}, got {arr.shape} {arr.dtype}')
+            self.buffer[self.fill] = arr
+            self.fill += 1
+            if self.fill == self.shard_size:
+                self.write_time += time.perf_counter() - start
+                self._flush()
+                start = time.perf_counter()
+        self.labels.extend(0 if l is None else l for l in labels)
+        self.keys.extend(keys)
+        self.index += len(images)
+        self.write_time += time.perf_counter() - start
+        return len(images)
+
+    def input_done(self):
+        """
+        Marks the samples put so far as those of the inputs done, called
+        by sharded plugins after each input, see preprocess_method.
+        """
+        self.input_ends.append(self.index)
+
+    def _flush(self):
+        if self.fill == 0:
+            return
+        start = time.perf_counter()
+        fn = f'data_{len(self.shards):05d}.npy'
+        np.save(os.path.join(self.path, fn), self.buffer[:self.fill])
+        self.shards.append(fn)
+        self.bytes += self.buffer[:self.fill].nbytes
+        self.fill = 0
+        self.commit_time += time.perf_counter() - start
 
     def __enter__(self):
         return self
@@ -537,20 +1229,485 @@ class LMDB_Dataset(object):
         self.close()
 
     def close(self):
-        self._put_batch()
-        self.db.close()
+        if self.closed:
+            return
+        self.closed = True
+        self._flush()
+        np.save(os.path.join(self.path, 'labels.npy'),
+                np.array(self.labels, dtype=np.int32))
+        np.save(os.path.join(self.path, 'keys.npy'),
+                np.array(self.keys, dtype=bytes))
+        info = dict(
+            backend='npy',
+            count=len(self.labels),
+            shard_size=self.shard_size,
+            shards=self.shards)
+        if self.buffer is not None:
+            info['shape'] = list(self.buffer.shape[1:])
+            info['dtype'] = self.buffer.dtype.str
+        with open(os.path.join(self.path, NPY_INDEX), 'w') as f:
+            yaml.dump(info, f)
+        add_stats(dict(
+            bytes=self.bytes, write_time=self.write_time,
+            commit_time=self.commit_time))
 
     def __del__(self):
         self.close()
 
 
-def lmdb_data(dataset_org):
-    db_raw = lmdb.open(dataset_org, readonly=True)
+_lmdb_envs = weakref.WeakValueDictionary()
+_lmdb_lock = threading.Lock()
+
 
-    with db_raw.begin() as txn:
+def _lmdb_file_id(path):
+    """
+    Identifies the database file at path. It changes when a dataset is
+    replaced by renaming another one over path.
+    """
+    try:
+        st = os.stat(os.path.join(path, 'data.mdb'))
+    except OSError:
+        return os.path.realpath(path)
+    return (st.st_dev, st.st_ino)
+
+
+def open_lmdb(path):
+    """
+    Opens a database read only. The environment is shared while any
+    reference to it is alive, since lmdb allows one per process per file.
+    Environments are keyed by the database file rather than the path, so
+    a dataset replaced at the same path gets a new one.
+    """
+    with _lmdb_lock:
+        while True:
+            key = (os.getpid(), _lmdb_file_id(path))
+            env = _lmdb_envs.get(key)
+            if env is not None:
+                return env
+            env = lmdb.open(path, readonly=True)
+            # Replaced between stat and open, the env may be of either file
+            if _lmdb_file_id(path) == key[1]:
+                _lmdb_envs[key] = env
+                return env
+            env.close()
+
+
+def lmdb_data(dataset_org, copy=False):
+    """
+    Yields (key, array) of each datum in the database. npy datasets are
+    read through NpyReader.
+
+    Arrays are read only views into the memory mapped database. They keep
+    the read transaction open, and the database is closed after the last
+    of them is released. Pass copy=True to get private arrays and end the
+    transaction when the generator finishes.
+    """
+    if is_sharded_dataset(dataset_org):
+        for name in read_shards_manifest(dataset_org)['shards']:
+            yield from lmdb_data(os.path.join(dataset_org, name), copy)
+        return
+    if is_npy_dataset(dataset_org):
+        reader = NpyReader(dataset_org)
+        for i in range(len(reader)):
+            arr, _ = reader[i]
+            yield reader.keys[i], arr.copy() if copy else arr
+        return
+    db_raw = open_lmdb(dataset_org)
+    txn = db_raw.begin(buffers=True)
+    owner = (db_raw, txn)
+    try:
         cursor = txn.cursor()
         for key, value in cursor:
-            datum = ufw_blob.Datum()
-            datum.ParseFromString(value)
-            yield key, datum_to_array(datum)
-    db_raw.close()
+            _, arr = parse_datum(value, copy, owner)
+            yield bytes(key), arr
+    finally:
+        if copy:
+            txn.abort()
+
+
+def _get_values(txn, keys):
+    """
+    Returns values of keys found in txn by key, in one cursor call where
+    py-lmdb has Cursor.getmulti (1.1.0+).
+    """
+    cursor = txn.cursor()
+    if hasattr(cursor, 'getmulti'):
+        return dict(cursor.getmulti(keys))
+    values = dict()
+    for key in keys:
+        value = txn.get(key)
+        if value is not None:
+            values[key] = value
+    return values
+
+
+class LMDBReader:
+    """
+    Random access reader of databases written by LMDB_Dataset.
+
+    Keys are listed once when the reader is created, item i is the i-th
+    key in order. Items are read from the same database file the keys
+    were listed from, also by shards and clones, even if the dataset is
+    replaced at path meanwhile. The database is opened lazily in other
+    processes, so a reader or its shards can be passed to worker
+    processes, which raise RuntimeError if the dataset was replaced.
+    lmdb does not survive fork, so forked workers need the parent to hold
+    no open reader or view of the same database, otherwise use spawn.
+    """
+    def __init__(self, path, copy=False, keys=None, env=None, file_id=None):
+        self.path = path
+        self.copy = copy
+        self.env = env
+        self.txn = None
+        if keys is None:
+            file_id = _lmdb_file_id(path)
+            self.env = open_lmdb(path)
+            with self.env.begin() as txn:
+                keys = list(txn.cursor().iternext(values=False))
+        self.keys = keys
+        self.file_id = file_id
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['env'] = None
+        state['txn'] = None
+        return state
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __begin(self):
+        if self.txn is None:
+            if self.env is None:
+                env = open_lmdb(self.path)
+                if self.file_id is not None and _lmdb_file_id(self.path) != self.file_id:
+                    raise RuntimeError(f'{self.path} was replaced after listing keys')
+                self.env = env
+            self.txn = self.env.begin(buffers=True)
+        return self.txn
+
+    def __getitem__(self, i):
+        """
+        Returns (array, label) of item i. Unless copy is set, array is a
+        read only view into the database.
+        """
+        txn = self.__begin()
+        value = txn.get(self.keys[i])
+        if value is None:
+            raise KeyError(self.keys[i])
+        datum, arr = parse_datum(value, self.copy, (self.env, txn))
+        return arr, datum.label
+
+    def get_items(self, indices):
+        """
+        Returns (arrays, labels) of items at indices. Arrays are only
+        valid until the next call.
+        """
+        keys = [self.keys[i] for i in indices]
+        values = _get_values(self.__begin(), keys)
+        arrays = []
+        labels = np.empty(len(keys), dtype=np.int32)
+        for i, key in enumerate(keys):
+            if key not in values:
+                raise KeyError(key)
+            datum, arr = parse_datum(values[key])
+            arrays.append(arr)
+            labels[i] = datum.label
+        return arrays, labels
+
+    def get_values(self, indices):
+        """
+        Returns serialized datums of items at indices.
+        """
+        keys = [self.keys[i] for i in indices]
+        values = _get_values(self.__begin(), keys)
+        for key in keys:
+            if key not in values:
+                raise KeyError(key)
+        return [bytes(values[key]) for key in keys]
+
+    def get_batch(self, indices):
+        """
+        Returns (batch, labels) of items at indices, stacked along a new
+        first axis.
+        """
+        arrays, labels = self.get_items(indices)
+        return np.stack(arrays), labels
+
+    def shard(self, rank, world):
+        """
+        Returns a reader of the rank-th of world contiguous parts.
+        """
+        if not 0 <= rank < world:
+            raise ValueError(f'Invalid rank {rank} of world {world}')
+        num = len(self.keys)
+        begin = num * rank // world
+        end = num * (rank + 1) // world
+        return LMDBReader(
+            self.path, self.copy, self.keys[begin:end], self.env, self.file_id)
+
+    def clone(self):
+        """
+        Returns a reader of the same items with its own transaction, for
+        use in another thread.
+        """
+        return LMDBReader(self.path, self.copy, self.keys, self.env, self.file_id)
+
+    def close(self):
+        """
+        Release the database. Views still alive keep it open.
+        """
+        self.env = None
+        self.txn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class NpyReader:
+    """
+    Reader of datasets written by NpyDataset, with the same interface
+    as LMDBReader. Items are read only views into memory mapped shards.
+    """
+    def __init__(self, path, copy=False, begin=0, end=None):
+        self.path = path
+        self.copy = copy
+        with open(os.path.join(path, NPY_INDEX)) as f:
+            self.info = yaml.safe_load(f)
+        count = self.info['count']
+        self.begin = begin
+        self.end = count if end is None else end
+        self.shard_size = self.info['shard_size']
+        self.arrays = None
+        self.labels = np.load(os.path.join(path, 'labels.npy'))[self.begin:self.end]
+        self.keys = np.load(os.path.join(path, 'keys.npy'))[self.begin:self.end].tolist()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['arrays'] = None
+        return state
+
+    def __len__(self):
+        return self.end - self.begin
+
+    def __shards(self):
+        if self.arrays is None:
+            self.arrays = [
+                np.load(os.path.join(self.path, fn), mmap_mode='r')
+                for fn in self.info['shards']]
+        return self.arrays
+
+    def __locate(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return divmod(self.begin + i, self.shard_size)
+
+    def __getitem__(self, i):
+        shard, offset = self.__locate(i)
+        arr = self.__shards()[shard][offset]
+        if self.copy:
+            arr = np.array(arr)
+        return arr, int(self.labels[i])
+
+    def get_items(self, indices):
+        shards = self.__shards()
+        arrays = []
+        for i in indices:
+            shard, offset = self.__locate(i)
+            arrays.append(shards[shard][offset])
+        return arrays, self.labels[list(indices)]
+
+    def get_batch(self, indices):
+        """
+        Returns (batch, labels) like LMDBReader.get_batch. A contiguous
+        range of items within one shard is returned as a view.
+        """
+        indices = list(indices)
+        if indices and indices == list(range(indices[0], indices[-1] + 1)):
+            first, offset = self.__locate(indices[0])
+            last, _ = self.__locate(indices[-1])
+            if first == last:
+                batch = self.__shards()[first][offset:offset + len(indices)]
+                return batch, self.labels[indices[0]:indices[-1] + 1]
+        arrays, labels = self.get_items(indices)
+        return np.stack(arrays), labels
+
+    def shard(self, rank, world):
+        if not 0 <= rank < world:
+            raise ValueError(f'Invalid rank {rank} of world {world}')
+        num = len(self)
+        begin = self.begin + num * rank // world
+        end = self.begin + num * (rank + 1) // world
+        return NpyReader(self.path, self.copy, begin, end)
+
+    def clone(self):
+        return self
+
+    def close(self):
+        self.arrays = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def is_npy_dataset(path):
+    return os.path.exists(os.path.join(path, NPY_INDEX))
+
+
+SHARDS_MANIFEST = 'shards.yaml'
+
+
+def is_sharded_dataset(path):
+    return os.path.exists(os.path.join(path, SHARDS_MANIFEST))
+
+
+def read_shards_manifest(path):
+    with open(os.path.join(path, SHARDS_MANIFEST)) as f:
+        return yaml.safe_load(f)
+
+
+def write_shards_manifest(path, shards, counts):
+    """
+    Records datasets in sub directories shards of path, in order, as one
+    dataset.
+    """
+    with open(os.path.join(path, SHARDS_MANIFEST), 'w') as f:
+        yaml.dump(dict(shards=shards, counts=counts), f)
+
+
+class ShardedReader:
+    """
+    Reader of a dataset stored as per shard datasets and a manifest,
+    with the same interface as LMDBReader.
+    """
+    def __init__(self, path, copy=False, readers=None, begin=0, end=None):
+        self.path = path
+        self.copy = copy
+        if readers is None:
+            readers = [
+                open_dataset(os.path.join(path, name), copy)
+                for name in read_shards_manifest(path)['shards']]
+        self.readers = readers
+        self.offsets = np.cumsum([0] + [len(r) for r in readers])
+        self.begin = begin
+        self.end = self.offsets[-1] if end is None else end
+        self.keys = [k for r in readers for k in r.keys][self.begin:self.end]
+
+    def __len__(self):
+        return self.end - self.begin
+
+    def locate(self, i):
+        """
+        Returns (reader, index) of the shard holding item i.
+        """
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        i += self.begin
+        r = int(np.searchsorted(self.offsets, i, side='right')) - 1
+        return self.readers[r], i - self.offsets[r]
+
+    def __getitem__(self, i):
+        reader, j = self.locate(i)
+        return reader[j]
+
+    def get_items(self, indices):
+        arrays = []
+        labels = []
+        for i in indices:
+            arr, label = self[i]
+            arrays.append(arr)
+            labels.append(label)
+        return arrays, np.array(labels, dtype=np.int32)
+
+    def get_batch(self, indices):
+        arrays, labels = self.get_items(indices)
+        return np.stack(arrays), labels
+
+    def shard(self, rank, world):
+        if not 0 <= rank < world:
+            raise ValueError(f'Invalid rank {rank} of world {world}')
+        num = len(self)
+        begin = self.begin + num * rank // world
+        end = self.begin + num * (rank + 1) // world
+        return ShardedReader(self.path, self.copy, self.readers, begin, end)
+
+    def clone(self):
+        return ShardedReader(
+            self.path, self.copy, [r.clone() for r in self.readers],
+            self.begin, self.end)
+
+    def close(self):
+        for r in self.readers:
+            r.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def copy_items(reader, indices, writer):
+    """
+    Append items of reader at indices to writer, keeping key suffixes.
+    Datums are copied without decoding between lmdb datasets.
+    """
+    indices = list(indices)
+    if isinstance(reader, ShardedReader):
+        located = [reader.locate(i) for i in indices]
+        for shard, group in itertools.groupby(located, key=lambda x: x[0]):
+            copy_items(shard, [j for _, j in group], writer)
+        return
+    suffixes = [reader.keys[i].split(b'__', 1)[1].decode() for i in indices]
+    if isinstance(reader, LMDBReader) and isinstance(writer, LMDB_Dataset):
+        keys = [
+            writer.DB_KEY_FORMAT.format(writer.index + i, k).encode()
+            for i, k in enumerate(suffixes)]
+        writer.put_datums(reader.get_values(indices), keys)
+    else:
+        for i, suffix in zip(indices, suffixes):
+            arr, label = reader[i]
+            writer._put(arr, label, suffix)
+    _count_samples(len(indices), new=False)
+
+
+def open_dataset(path, copy=False):
+    """
+    Returns a reader of a dataset written by either backend.
+    """
+    if is_sharded_dataset(path):
+        return ShardedReader(path, copy)
+    if is_npy_dataset(path):
+        return NpyReader(path, copy)
+    return LMDBReader(path, copy)
+
+
+dataset_backends = dict(lmdb=LMDB_Dataset, npy=NpyDataset)
+
+
+def dataset_writer(config, **kwargs):
+    """
+    Returns a writer at config['lmdb_out'] of the backend selected by
+    config['input']['backend'], lmdb by default. lmdb datums are stored
+    as config['input']['encoding'] and ['compress'] if given, see
+    array_to_datum.
+    """
+    data_config = config.get('input', dict())
+    backend = data_config.get('backend', 'lmdb')
+    if backend not in dataset_backends:
+        raise ValueError(f'Unknown dataset backend {backend}')
+    if backend == 'lmdb':
+        for key in ['encoding', 'compress']:
+            if key in data_config:
+                kwargs.setdefault(key, data_config[key])
+    return dataset_backends[backend](config['lmdb_out'], **kwargs)
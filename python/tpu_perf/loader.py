@@ -0,0 +1,166 @@
+import time
+import logging
+import threading
+import ctypes as ct
+import numpy as np
+import multiprocessing as mp
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from .io import open_dataset
+try:
+    # Python 3.8+, only needed by process workers
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+_worker_reader = None
+
+def _init_worker(reader):
+    global _worker_reader
+    _worker_reader = reader
+
+def _decode_to_shm(indices):
+    arrays, labels = _worker_reader.get_items(indices)
+    shape = (len(arrays), ) + arrays[0].shape
+    dtype = arrays[0].dtype
+    size = int(np.prod(shape)) * dtype.itemsize
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    out = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    np.stack(arrays, out=out)
+    del out
+    shm.close()
+    return shm.name, shape, dtype.str, labels
+
+def _attach_shm(name, shape, dtype, labels):
+    """
+    Map a batch written by a worker. The segment is unlinked at once and
+    unmapped when the batch array is released.
+    """
+    shm = shared_memory.SharedMemory(name=name)
+    shm.unlink()
+    address = np.frombuffer(shm.buf, dtype=np.uint8).ctypes.data
+    buffer = (ct.c_byte * shm.size).from_address(address)
+    buffer._owner = shm
+    dtype = np.dtype(dtype)
+    batch = np.frombuffer(
+        buffer, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+    return batch, labels
+
+class LMDBLoader:
+    """
+    Prefetching batch loader over an LMDBReader or NpyReader.
+
+    Batches are decoded by a pool of workers, at most prefetch batches
+    ahead of the consumer, and yielded in order as (batch, labels).
+    Thread workers each hold their own read transaction. Process workers
+    decode into shared memory, so batches are not copied back through a
+    pipe, and are started with spawn since lmdb does not survive fork.
+
+    The loader accounts time spent waiting for a batch to be decoded as
+    data wait, and time spent by the consumer between batches, usually
+    inference, as device wait.
+    """
+    def __init__(
+            self, reader, batch_size=1, workers=2, prefetch=4,
+            processes=False, indices=None, drop_last=False):
+        if isinstance(reader, str):
+            reader = open_dataset(reader)
+        self.reader = reader
+        self.prefetch = prefetch
+        self.processes = processes
+        indices = list(range(len(reader)) if indices is None else indices)
+        self.batches = [
+            indices[i:i + batch_size]
+            for i in range(0, len(indices), batch_size)]
+        if drop_last and self.batches and len(self.batches[-1]) < batch_size:
+            self.batches.pop()
+        if processes:
+            if shared_memory is None:
+                raise RuntimeError('process workers need Python 3.8+')
+            self.executor = ProcessPoolExecutor(
+                workers, mp_context=mp.get_context('spawn'),
+                initializer=_init_worker, initargs=(reader, ))
+        else:
+            self.local = threading.local()
+            self.executor = ThreadPoolExecutor(workers)
+        self.reset_stats()
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __decode(self, indices):
+        reader = getattr(self.local, 'reader', None)
+        if reader is None:
+            reader = self.reader.clone()
+            self.local.reader = reader
+        return reader.get_batch(indices)
+
+    def __submit(self, indices):
+        if self.processes:
+            return self.executor.submit(_decode_to_shm, indices)
+        return self.executor.submit(self.__decode, indices)
+
+    def __result(self, future):
+        if self.processes:
+            return _attach_shm(*future.result())
+        return future.result()
+
+    def __iter__(self):
+        self.reset_stats()
+        pending = deque()
+        batches = iter(self.batches)
+
+        def fill():
+            while len(pending) < self.prefetch:
+                indices = next(batches, None)
+                if indices is None:
+                    break
+                pending.append(self.__submit(indices))
+
+        fill()
+        try:
+            while pending:
+                start = time.perf_counter()
+                future = pending.popleft()
+                fill()
+                batch = self.__result(future)
+                ready = time.perf_counter()
+                self.data_wait += ready - start
+                yield batch
+                self.device_wait += time.perf_counter() - ready
+                self.batch_count += 1
+        finally:
+            for future in pending:
+                if not future.cancel() and future.exception() is None:
+                    self.__result(future)
+        self.show()
+
+    def reset_stats(self):
+        self.batch_count = 0
+        self.data_wait = 0
+        self.device_wait = 0
+
+    def stats(self):
+        total = self.data_wait + self.device_wait
+        return dict(
+            batches=self.batch_count,
+            data_wait=self.data_wait,
+            device_wait=self.device_wait,
+            data_stall=self.data_wait / total if total > 0 else 0)
+
+    def show(self):
+        stats = self.stats()
+        logging.info(
+            f'Loader {stats["batches"]} batches, '
+            f'waiting on data {stats["data_wait"]:.3f}s, '
+            f'waiting on device {stats["device_wait"]:.3f}s, '
+            f'data stall {stats["data_stall"]:.2%}')
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,196 @@
+import os
+import re
+import sys
+import csv
+import time
+import random
+import logging
+import argparse
+import threading
+from .buildtree import check_buildtree, BuildTree
+from .infer import SGInfer
+from .infer_bench import make_inputs, percentile
+from .util import iter_mlir_bmodels, iter_nntc_bmodels, walk_run_configs, collect_extra_headers
+from .logger import init_logger
+
+def iter_bmodels(tree, config, mlir=False):
+    """
+    Yields (config, name, batch, bmodel) of the bmodels tpu_perf.run times
+    for a model config, config being the one of its stats.csv row, with
+    fp_loops or int8_loops and prec applied.
+    """
+    if mlir:
+        for _, args, prec, bmodel in iter_mlir_bmodels(tree, config):
+            name = os.path.basename(args.model).replace('.bmodel', '')
+            yield dict(config, prec=prec), name, 1, bmodel
+        return
+    if not config.get('time', True):
+        return
+    yield from iter_nntc_bmodels(tree, config)
+
+def measure_peak(infer, inputs, duration):
+    """
+    Offline throughput in requests/sec with the runner kept busy.
+    """
+    count = 0
+    window = 32
+    start = time.perf_counter()
+    futures = [infer.submit(*inputs) for _ in range(window)]
+    while time.perf_counter() - start < duration:
+        futures.pop(0).result()
+        count += 1
+        futures.append(infer.submit(*inputs))
+    for f in futures:
+        f.result()
+        count += 1
+    return count / (time.perf_counter() - start)
+
+def run_load(infer, inputs, rate, duration, arrival='poisson'):
+    """
+    Issue requests at rate per second for duration seconds, open loop.
+    Latency is measured from the scheduled arrival time, so a stalled
+    sender does not hide queueing delay.
+    """
+    latency = []
+    lock = threading.Lock()
+    finished = threading.Event()
+    pending = [0]
+    sent = [False]
+
+    def done(scheduled, future):
+        end = time.perf_counter()
+        with lock:
+            if future.exception() is None:
+                latency.append((end - scheduled) * 1000)
+            pending[0] -= 1
+            if sent[0] and pending[0] == 0:
+                finished.set()
+
+    start = time.perf_counter()
+    scheduled = start
+    while scheduled - start < duration:
+        if arrival == 'poisson':
+            scheduled += random.expovariate(rate)
+        else:
+            scheduled += 1.0 / rate
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        with lock:
+            pending[0] += 1
+        future = infer.submit(*inputs)
+        future.add_done_callback(lambda f, s=scheduled: done(s, f))
+    with lock:
+        sent[0] = True
+        if pending[0] == 0:
+            finished.set()
+    finished.wait()
+    total = time.perf_counter() - start
+    return dict(
+        target_qps=rate,
+        qps=len(latency) / total,
+        samples=len(latency),
+        latency_mean=sum(latency) / len(latency) if latency else float('nan'),
+        latency_p50=percentile(latency, 50),
+        latency_p90=percentile(latency, 90),
+        latency_p99=percentile(latency, 99))
+
+def sweep(infer, inputs, args):
+    """
+    Run the load at each rate. Rates are requests/sec and each request
+    carries one model batch.
+    """
+    if args.rates:
+        rates = args.rates
+    else:
+        peak = measure_peak(infer, inputs, args.duration)
+        logging.info(f'Offline throughput {peak:.1f} requests/s')
+        rates = [peak * f for f in args.fractions]
+    results = []
+    for rate in rates:
+        stats = run_load(infer, inputs, rate, args.duration, args.arrival)
+        stats['slo_met'] = stats['latency_p99'] <= args.slo
+        logging.info(
+            f'  target {rate:.1f}/s, achieved {stats["qps"]:.1f}/s, '
+            f'p50 {stats["latency_p50"]:.3f}ms p99 {stats["latency_p99"]:.3f}ms'
+            f'{"" if stats["slo_met"] else " (SLO missed)"}')
+        results.append(stats)
+    return results
+
+def best_under_slo(results):
+    """
+    Returns stats of the highest achieved rate which met the SLO, or None.
+    """
+    passed = [s for s in results if s['slo_met']]
+    return max(passed, key=lambda s: s['qps']) if passed else None
+
+def main():
+    init_logger()
+
+    parser = argparse.ArgumentParser(description='tpu-perf server scenario load generator')
+    BuildTree.add_arguments(parser)
+    parser.add_argument('--slo', type=float, default=10, help='p99 latency SLO in ms')
+    parser.add_argument(
+        '--arrival', type=str, default='poisson', choices=['poisson', 'constant'],
+        help='Request arrival process')
+    parser.add_argument('--duration', type=float, default=5, help='Seconds per rate')
+    parser.add_argument(
+        '--rates', type=float, nargs='*',
+        help='Request rates to sweep, default is fractions of offline throughput')
+    parser.add_argument(
+        '--fractions', type=float, nargs='*',
+        default=[0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0],
+        help='Fractions of offline throughput to sweep')
+    args = parser.parse_args()
+
+    if not check_buildtree():
+        sys.exit(1)
+
+    tree = BuildTree(os.path.abspath('.'), args)
+    outdir = tree.global_config['outdir']
+    devices = tree.global_config['devices']
+    sweep_fn = os.path.join(outdir, 'loadgen_sweep.csv')
+    summary_fn = os.path.join(outdir, 'loadgen.csv')
+    # Same name and extra columns as stats.csv of tpu_perf.run
+    extra = collect_extra_headers(tree, args.mlir)
+    with open(sweep_fn, 'w') as sweep_f, open(summary_fn, 'w') as summary_f:
+        sweep_csv = csv.writer(sweep_f)
+        sweep_csv.writerow([
+            'name', *extra, 'bmodel', 'shape', 'arrival', 'target_qps', 'qps',
+            'latency_mean(ms)', 'latency_p50(ms)', 'latency_p90(ms)', 'latency_p99(ms)',
+            'slo_met'])
+        summary_csv = csv.writer(summary_f)
+        summary_csv.writerow([
+            'name', *extra, 'bmodel', 'shape', 'arrival', 'slo_p99(ms)', 'max_qps',
+            'latency_p99(ms)'])
+        for path, raw_config in walk_run_configs(tree):
+            core_suffix = '' if raw_config['num_core'] == 1 else f'_core{raw_config["num_core"]}'
+            model_name = f'{raw_config["name"]}{core_suffix}'
+            for config, name, b, bmodel in iter_bmodels(tree, raw_config, args.mlir):
+                if not os.path.exists(bmodel):
+                    logging.warning(f'{bmodel} does not exist')
+                    continue
+                columns = [model_name, *[config.get(k, '') for k in extra], name]
+                shape = config.get('shape_key', '')
+                logging.info(f'Load test {model_name} {name}')
+                infer = SGInfer(bmodel, b, devices)
+                inputs = make_inputs(infer)
+                results = sweep(infer, inputs, args)
+                del infer
+                for stats in results:
+                    sweep_csv.writerow([
+                        *columns, shape, args.arrival,
+                        f'{stats["target_qps"]:.2f}', f'{stats["qps"]:.2f}',
+                        f'{stats["latency_mean"]:.3f}', f'{stats["latency_p50"]:.3f}',
+                        f'{stats["latency_p90"]:.3f}', f'{stats["latency_p99"]:.3f}',
+                        stats['slo_met']])
+                best = best_under_slo(results)
+                summary_csv.writerow([
+                    *columns, shape, args.arrival, args.slo,
+                    f'{best["qps"]:.2f}' if best else 'N/A',
+                    f'{best["latency_p99"]:.3f}' if best else 'N/A'])
+                summary_f.flush()
+                sweep_f.flush()
+
+if __name__ == '__main__':
+    main()
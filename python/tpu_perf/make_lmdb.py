@@ -1,47 +1,129 @@
 import sys
 import os
+import csv
+import time
+import shutil
 import logging
+import multiprocessing
 from .buildtree import check_buildtree, BuildTree
-from .subp import sys_memory_size
+from .subp import sys_memory_size, reset_peak_rss, peak_rss
 
 from .preprocess import load_plugins
 load_plugins()
 
-from threading import Lock
+from .preprocess import get_preprocess_method, dataset_up_to_date
+from .io import take_stats, set_progress_counter
 
-lock = Lock()
+def dataset_ready(out_path):
+    return os.path.exists(os.path.join(out_path, 'info.yaml'))
 
-from .preprocess import get_preprocess_method
+def need_build(config):
+    return 'input' in config and 'preprocess' in config['input']
 
 def build_lmdb(tree, path, config):
+    """
+    Preprocess into a temp dir and rename it to lmdb_out when complete,
+    so an existing lmdb_out is always a complete dataset. A dataset of a
+    sharded plugin whose inputs changed is patched, see run_sharded.
+
+    Returns stats of the build, or None if the dataset is up to date.
+    """
+    if not need_build(config):
+        return
+    data_config = config['input']
+    out_path = config['lmdb_out']
+    if dataset_ready(out_path) and dataset_up_to_date(tree, config):
+        logging.info(f'{config["name"]} {out_path} already exist')
+        return
+
+    preprocess = get_preprocess_method(data_config['preprocess'])
+
+    tmp_path = f'{out_path}.tmp.{os.getpid()}'
+    old_path = f'{out_path}.old.{os.getpid()}'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    take_stats()
+    reset_peak_rss()
+    start = time.perf_counter()
     try:
-        if 'input' not in config:
-            return
-        data_config = config['input']
-        if 'preprocess' not in data_config:
-            return
-        out_path = config['lmdb_out']
-
-        preprocess = get_preprocess_method(data_config['preprocess'])
-
-        with lock:
-            if os.path.exists(os.path.join(out_path, 'info.yaml')):
-                logging.info(f'{config["name"]} {out_path} already exist')
-                return
-            os.makedirs(out_path, exist_ok=True)
-            info_fn = os.path.join(out_path, 'info.yaml')
-            import yaml
-            with open(info_fn, 'w') as f:
-                yaml.dump(data_config, f)
-
-        preprocess(tree, config)
+        preprocess(tree, dict(config, lmdb_out=tmp_path, lmdb_final=out_path))
+        elapsed = time.perf_counter() - start
+        info_fn = os.path.join(tmp_path, 'info.yaml')
+        import yaml
+        with open(info_fn, 'w') as f:
+            yaml.dump(data_config, f)
+        if os.path.exists(out_path):
+            # Outdated, or left by an interrupted build of an older version
+            os.rename(out_path, old_path)
+        try:
+            os.rename(tmp_path, out_path)
+        except OSError:
+            if not dataset_ready(out_path):
+                raise
+            logging.info(f'{config["name"]} {out_path} built by another process')
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        shutil.rmtree(old_path, ignore_errors=True)
+        shutil.rmtree(f'{out_path}.partial', ignore_errors=True)
     except Exception as err:
-        import shutil
-        shutil.rmtree(out_path, ignore_errors=True)
-        import sys
-        print(sys.exc_info())
+        shutil.rmtree(tmp_path, ignore_errors=True)
         logging.error(f'{path} quit because of exception, {err}')
-        os._exit(-1)
+        raise
+
+    stats = take_stats()
+    stats.update(
+        name=config['name'], dataset=out_path, time=elapsed,
+        peak_rss=max(stats.get('peak_rss', 0), peak_rss()))
+    samples = stats.get('samples', 0)
+    logging.info(
+        f'{config["name"]} {samples} samples, {stats.get("new_samples", 0)} preprocessed, '
+        f'in {elapsed:.2f}s, {samples / elapsed:.1f} samples/s, '
+        f'{stats.get("bytes", 0) / 1e6:.1f}MB written, '
+        f'peak RSS {stats["peak_rss"] / 1024:.0f}MB')
+    return stats
+
+stats_stages = ['plugin', 'decode', 'transform', 'write', 'commit', 'commit_wait']
+
+stats_header = \
+    ['name', 'dataset', 'samples', 'new_samples', 'time(s)', 'samples/s', 'MB'] + \
+    [f'{stage}(s)' for stage in stats_stages] + ['peak_rss(MB)']
+
+def stats_row(stats):
+    """
+    samples and MB are of the dataset written, new_samples were
+    preprocessed by the plugin and the rest reused from an earlier build.
+    Stage times are summed over threads and worker processes, and overlap,
+    e.g. plugin time includes the writes, and the decode and transform
+    time of io's image and transform helpers or marked by the plugin, so
+    they may add up to more than time(s).
+    """
+    samples = stats.get('samples', 0)
+    return [
+        stats['name'], stats['dataset'], samples, stats.get('new_samples', 0),
+        f'{stats["time"]:.2f}', f'{samples / stats["time"]:.1f}',
+        f'{stats.get("bytes", 0) / 1e6:.2f}'] + [
+        f'{stats.get(f"{stage}_time", 0):.2f}' for stage in stats_stages] + [
+        f'{stats["peak_rss"] / 1024:.1f}']
+
+def show_progress(done, total, samples, elapsed):
+    sys.stderr.write(
+        f'\r{done}/{total} datasets, {samples} samples, '
+        f'{samples / elapsed:.1f} samples/s, {elapsed:.0f}s')
+    sys.stderr.flush()
+
+def submit_builds(tree, executor):
+    """
+    Submit one build per distinct dataset and return futures by
+    lmdb_out. Models sharing a dataset wait on the same future.
+    """
+    futures = dict()
+    for path, config in tree.walk():
+        if not need_build(config):
+            continue
+        out_path = config['lmdb_out']
+        if out_path in futures:
+            continue
+        futures[out_path] = executor.submit(build_lmdb, tree, path, config)
+    return futures
 
 def main():
     logging.basicConfig(
@@ -53,6 +135,7 @@ def main():
     import argparse
     parser = argparse.ArgumentParser(description='tpu-perf benchmark tool')
     BuildTree.add_arguments(parser)
+    parser.add_argument('--progress', action='store_true', help='Show a live progress line')
     args = parser.parse_args()
     tree = BuildTree(os.path.abspath('.'), args)
 
@@ -70,19 +153,39 @@ def main():
     #    build_lmdb(tree, path, config)
     #return
 
-    from concurrent.futures import ThreadPoolExecutor, as_completed
-    with ThreadPoolExecutor(max_workers=num_workers) as executor:
-        futures = []
-
-        for path, config in tree.walk():
-            f = executor.submit(build_lmdb, tree, path, config)
-            futures.append(f)
-
-        for f in as_completed(futures):
-            err = f.exception()
-            if err:
-                logging.error(f'Quit because of exception, {err}')
-                os._exit(-1)
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+    counter = multiprocessing.Value('q', 0)
+    stats_fn = os.path.join(tree.global_config['outdir'], 'preprocess_stats.csv')
+    with ProcessPoolExecutor(
+            max_workers=num_workers, initializer=set_progress_counter,
+            initargs=(counter, )) as executor, open(stats_fn, 'w') as f:
+        csv_f = csv.writer(f)
+        csv_f.writerow(stats_header)
+        futures = submit_builds(tree, executor)
+        pending = set(futures.values())
+        start = time.perf_counter()
+        while pending:
+            done, pending = wait(
+                pending, timeout=1 if args.progress else None,
+                return_when=FIRST_COMPLETED)
+            for future in done:
+                err = future.exception()
+                if err:
+                    logging.error(f'Quit because of exception, {err}')
+                    # Workers would outlive os._exit and keep building
+                    for child in multiprocessing.active_children():
+                        child.kill()
+                    os._exit(-1)
+                stats = future.result()
+                if stats is not None:
+                    csv_f.writerow(stats_row(stats))
+                    f.flush()
+            if args.progress:
+                show_progress(
+                    len(futures) - len(pending), len(futures),
+                    counter.value, time.perf_counter() - start)
+        if args.progress:
+            sys.stderr.write('\n')
 
 if __name__ == '__main__':
     main()
@@ -1,14 +1,244 @@
+import os
+import json
+import time
+import shutil
+import logging
+import functools
+from concurrent.futures import ProcessPoolExecutor
 
 _preprocess_functions = dict()
+_sharded_functions = dict()
 
 def load_plugins():
     from . import util
     util.load_plugins('dataset')
 
-def preprocess_method(key):
+def preprocess_method(key, list_inputs=None):
+    """
+    Register a preprocess plugin called as fn(tree, config), which writes
+    the dataset to config['lmdb_out'].
+
+    With list_inputs the plugin is sharded. list_inputs(tree, config)
+    returns the inputs, e.g. image files. fn(tree, config, inputs, writer)
+    is called once on each part of them in worker processes, so it can
+    batch inside a part. It should put samples of inputs into writer in
+    order, and call writer.input_done() after the samples of each input,
+    which records the keys of every input for resuming. See run_sharded
+    for the input config.
+
+    Time spent in fn is recorded as plugin_time, see io.timed.
+    """
     def register(fn):
-        _preprocess_functions[key] = fn
+        if list_inputs is None:
+            from .io import timed
+            _preprocess_functions[key] = timed('plugin')(fn)
+            return
+        _sharded_functions[key] = (fn, list_inputs)
+        _preprocess_functions[key] = functools.partial(run_sharded, key)
     return register
 
 def get_preprocess_method(key):
     return _preprocess_functions[key]
+
+MANIFEST = 'manifest.json'
+
+# Input options which do not change samples
+_layout_options = ['shards', 'shard_output', 'chunk_size']
+
+def _sample_config(data_config):
+    return {k: v for k, v in data_config.items() if k not in _layout_options}
+
+def _input_stat(x):
+    """
+    Identifies an input by path, size and mtime when it is a file.
+    """
+    name = str(x)
+    if isinstance(x, str) and os.path.isfile(x):
+        st = os.stat(x)
+        return [name, st.st_size, st.st_mtime_ns]
+    return [name, None, None]
+
+def read_manifest(path):
+    fn = os.path.join(path, MANIFEST)
+    if not os.path.exists(fn):
+        return None
+    with open(fn) as f:
+        return json.load(f)
+
+def _write_manifest(path, config, entries):
+    with open(os.path.join(path, MANIFEST), 'w') as f:
+        json.dump(dict(config=_sample_config(config['input']), inputs=entries), f)
+
+def _run_chunk(key, tree, config, inputs, out_path):
+    """
+    Preprocess inputs into a dataset at out_path in one plugin call, with
+    a manifest of the keys written for each input as marked by
+    writer.input_done(). The dataset appears at out_path only when
+    complete. Returns stats of the chunk.
+    """
+    from .io import dataset_writer, open_dataset, take_stats, timed
+    from .subp import reset_peak_rss, peak_rss
+    if key not in _sharded_functions:
+        load_plugins()
+    fn, _ = _sharded_functions[key]
+    take_stats()
+    reset_peak_rss()
+    tmp_path = f'{out_path}.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    with dataset_writer(dict(config, lmdb_out=tmp_path)) as writer:
+        with timed('plugin'):
+            fn(tree, config, inputs, writer)
+    ends = writer.input_ends
+    if len(ends) != len(inputs) or ends[-1] != writer.index:
+        raise RuntimeError(
+            f'{key} marked {len(ends)} of {len(inputs)} inputs done, '
+            'writer.input_done() should be called after the samples of each input')
+    counts = [end - begin for begin, end in zip([0] + ends[:-1], ends)]
+    keys = [
+        k.split(b'__', 1)[1].decode()
+        for k in open_dataset(tmp_path).keys] if sum(counts) else []
+    entries = []
+    for x, n in zip(inputs, counts):
+        entries.append(dict(stat=_input_stat(x), keys=keys[:n]))
+        keys = keys[n:]
+    _write_manifest(tmp_path, config, entries)
+    os.rename(tmp_path, out_path)
+    return dict(take_stats(), peak_rss=peak_rss())
+
+def _collect_samples(path, config, samples):
+    """
+    Adds (dataset, begin, count) of each input recorded in the manifest of
+    the dataset at path to samples, keyed by input stat, if the dataset
+    was built with the same sample config.
+    """
+    manifest = read_manifest(path)
+    if manifest is None or manifest['config'] != _sample_config(config['input']):
+        return
+    begin = 0
+    for entry in manifest['inputs']:
+        count = len(entry['keys'])
+        samples[tuple(entry['stat'])] = (path, begin, count)
+        begin += count
+
+def dataset_up_to_date(tree, config):
+    """
+    Whether the dataset at lmdb_out was built from the current inputs.
+    Datasets of plain plugins, or built without a manifest, are taken
+    as up to date.
+    """
+    key = config['input']['preprocess']
+    if key not in _sharded_functions:
+        return True
+    manifest = read_manifest(config['lmdb_out'])
+    if manifest is None:
+        return True
+    _, list_inputs = _sharded_functions[key]
+    stats = [_input_stat(x) for x in list_inputs(tree, config)]
+    return manifest['config'] == _sample_config(config['input']) and \
+        [e['stat'] for e in manifest['inputs']] == stats
+
+def run_sharded(key, tree, config):
+    """
+    Run a sharded plugin over `shards` processes, all cpus by default.
+
+    Inputs are preprocessed in chunks of `chunk_size` inputs, each into
+    its own dataset under `<lmdb_final>.partial` with a manifest of the
+    input file size, mtime and keys written for every input. Completed
+    chunks survive an interrupted build, and inputs recorded by them or
+    by the manifest of the existing dataset at lmdb_final are not
+    preprocessed again when unchanged, so an interrupted or slightly
+    changed dataset is resumed or patched. lmdb_final defaults to
+    lmdb_out.
+
+    With `shard_output: merge`, the default, samples are then written to
+    one dataset in input order, so keys are the same as a sequential
+    run. With `shard_output: split`, they are written to `shards`
+    datasets under lmdb_out listed by a manifest, which open_dataset and
+    lmdb_data read as one dataset.
+    """
+    from .io import dataset_writer, open_dataset, copy_items, write_shards_manifest
+    from .io import add_stats, set_progress_counter, progress_counter
+    fn, list_inputs = _sharded_functions[key]
+    data_config = config['input']
+    inputs = list(list_inputs(tree, config))
+    stats = [tuple(_input_stat(x)) for x in inputs]
+    out_path = config['lmdb_out']
+    final_path = config.get('lmdb_final', out_path)
+    partial_dir = f'{final_path}.partial'
+
+    samples = dict()
+    if final_path != out_path:
+        _collect_samples(final_path, config, samples)
+    if os.path.isdir(partial_dir):
+        # Later chunks take precedence
+        for name in sorted(os.listdir(partial_dir)):
+            if name.endswith('.tmp'):
+                continue
+            _collect_samples(os.path.join(partial_dir, name), config, samples)
+
+    # Inputs which are not files have no stat to tell a change
+    missing = [
+        x for x, stat in zip(inputs, stats)
+        if stat[1] is None or stat not in samples]
+    num = data_config.get('shards', os.cpu_count())
+    chunk_size = data_config.get('chunk_size', 256)
+    chunks = [missing[i:i + chunk_size] for i in range(0, len(missing), chunk_size)]
+    logging.info(
+        f'{config["name"]} preprocessing {len(missing)} of {len(inputs)} inputs '
+        f'in {len(chunks)} chunks')
+    if chunks:
+        os.makedirs(partial_dir, exist_ok=True)
+        prefix = f'chunk_{time.time_ns()}_{os.getpid()}'
+        paths = [os.path.join(partial_dir, f'{prefix}_{i:05d}') for i in range(len(chunks))]
+        with ProcessPoolExecutor(
+                max(1, min(num, len(chunks))), initializer=set_progress_counter,
+                initargs=(progress_counter(), )) as executor:
+            futures = [
+                executor.submit(_run_chunk, key, tree, config, chunk, path)
+                for chunk, path in zip(chunks, paths)]
+            for f in futures:
+                chunk_stats = f.result()
+                # Chunks are copied into lmdb_out, where samples and bytes count
+                chunk_stats.pop('samples', None)
+                chunk_stats.pop('bytes', None)
+                add_stats(chunk_stats)
+        for path in paths:
+            _collect_samples(path, config, samples)
+
+    readers = dict()
+    def write(stats, writer):
+        entries = []
+        for stat in stats:
+            path, begin, count = samples[stat]
+            if path not in readers:
+                readers[path] = open_dataset(path)
+            copy_items(readers[path], range(begin, begin + count), writer)
+            keys = readers[path].keys[begin:begin + count]
+            entries.append(dict(
+                stat=list(stat), keys=[k.split(b'__', 1)[1].decode() for k in keys]))
+        return entries
+
+    try:
+        if data_config.get('shard_output', 'merge') == 'split':
+            num = max(1, min(num, len(inputs)))
+            names = [f'shard_{i:05d}' for i in range(num)]
+            bounds = [len(inputs) * i // num for i in range(num + 1)]
+            entries = []
+            counts = []
+            for i in range(num):
+                with dataset_writer(dict(config, lmdb_out=os.path.join(out_path, names[i]))) as writer:
+                    # Keys of the shard continue from its first sample
+                    writer.index = sum(counts)
+                    entries += write(stats[bounds[i]:bounds[i + 1]], writer)
+                    counts.append(writer.index - sum(counts))
+            write_shards_manifest(out_path, names, counts)
+        else:
+            with dataset_writer(config) as writer:
+                entries = write(stats, writer)
+        _write_manifest(out_path, config, entries)
+        if final_path == out_path:
+            shutil.rmtree(partial_dir, ignore_errors=True)
+    finally:
+        for reader in readers.values():
+            reader.close()
+        readers.clear()
@@ -337,44 +337,19 @@ def run_mlir(tree, path, raw_config, stat_f, launch_time_f, extra, cache=False):
     succeed = []
     failed = []
     
-    parser = argparse.ArgumentParser(description='MLIR deploy')
-    parser.add_argument(
-        "--quantize", default="F32",
-        type=str.upper, choices=['F32', 'BF16', 'F16', 'INT8', 'QDQ'],
-        help="set default qauntization type: F32/BF16/F16/INT8")
-    parser.add_argument(
-        "--chip", required=True, type=str.lower,
-        choices=['bm1688', 'bm1684x', 'bm1684',
-            'cv186x', 'cv183x', 'cv182x', 'cv181x', 'cv180x'],
-        help="chip platform name")
-    parser.add_argument("--model", required=True, help='output model')
-    parser.add_argument(
-        "--asymmetric", action='store_true',
-        help="do INT8 asymmetric quantization")
-
-    for i, deploy in enumerate(deploies):
-        title = f'mlir_deploy_core{raw_config["num_core"]}.{i}'
+    for title, args, name, bmodel in iter_mlir_bmodels(tree, raw_config):
         cwd = os.path.join(workdir, title)
-        deploy = tree.expand_variables(raw_config, deploy)
-        args, _ = parser.parse_known_args(deploy.split())
-        bmodel = args.model.replace('.bmodel', '/compilation.bmodel')
         profile_path = args.model + '.compiler_profile_0.txt'
         if args.chip == 'bm1684' and not os.path.exists(profile_path):
             profile_path = os.path.join(cwd, 'compiler_profile_0.dat')
-        prec = args.quantize
-        if re.match('^F\d+$', prec):
-            prec = prec.replace('F', 'FP')
 
-        name = prec
-        if args.asymmetric:
-            name += '-asym'
         raw_config['prec'] = name
         ok, msg = run_model(
             tree, raw_config,
             name,
             1,
             profile_path,
-            bmodel if os.path.exists(bmodel) else args.model,
+            bmodel,
             stat_f, launch_time_f, extra, cache)
 
         expand_name = os.path.basename(args.model).replace(".bmodel",'')
@@ -390,71 +365,21 @@ def run_nntc(tree, path, raw_config, stat_f, launch_time_f, extra, cache=False):
 
     if not raw_config.get('time', True):
         return ok, ''
-    workdir = raw_config['workdir']
 
     profile_fn = 'compiler_profile_0.dat' \
         if tree.global_config['target'] == 'BM1684' else \
         'compiler_profile_0.txt'
-    fp_loops = raw_config.get('fp_loops') or \
-        tree.global_config.get('fp_loops') or [dict()]
-    for loop in fp_loops:
-        if 'fp_compile_options' not in raw_config:
-            # Skip fp bmrt test
-            break
-        config = dict_override(raw_config, loop)
-        batch_sizes = config.get('fp_batch_sizes', [1])
-        for b in batch_sizes:
-            name = config.get('fp_outdir_template', '{}b.fp.compilation').format(b)
-            bmodel_dir = os.path.join(workdir, name)
-            bmodel = os.path.join(bmodel_dir, 'compilation.bmodel')
-            if not os.path.exists(bmodel):
-                logging.warning(f'{bmodel} does not exist')
-                continue
-            profile_path = os.path.join(bmodel_dir, profile_fn)
-            if 'prec' not in config:
-                config['prec'] = 'FP32'
-            ok, msg = run_model(
-                tree, config, name, b, profile_path,
-                bmodel, stat_f, launch_time_f, extra) and ok
-
-    int8_loops = raw_config.get('int8_loops') or \
-        tree.global_config.get('int8_loops') or [dict()]
-    for loop in int8_loops:
-        if 'bmnetu_options' not in raw_config:
-            # Skip bmrt test
-            break
-        config = dict_override(raw_config, loop)
-        for b in config['bmnetu_batch_sizes']:
-            name = config.get('int8_outdir_template', '{}b.compilation').format(b)
-            bmodel_dir = os.path.join(workdir, name)
-            bmodel = os.path.join(bmodel_dir, 'compilation.bmodel')
-            if not os.path.exists(bmodel):
-                logging.warning(f'{bmodel} does not exist')
-                continue
-            profile_path = os.path.join(bmodel_dir, profile_fn)
-            if 'prec' not in config:
-                config['prec'] = 'INT8'
-            ok, msg = run_model(
-                tree, config, name, b, profile_path,
-                bmodel, stat_f, launch_time_f, extra) and ok
+    for config, name, b, bmodel in iter_nntc_bmodels(tree, raw_config):
+        if not os.path.exists(bmodel):
+            logging.warning(f'{bmodel} does not exist')
+            continue
+        profile_path = os.path.join(os.path.dirname(bmodel), profile_fn)
+        ok, msg = run_model(
+            tree, config, name, b, profile_path,
+            bmodel, stat_f, launch_time_f, extra) and ok
 
     return ok, msg
 
-def collect_nntc_headers(tree, config):
-    extra = set()
-    for loop in config.get('fp_loops', [dict()]):
-        for k in loop.keys():
-            extra.add(k)
-    for loop in config.get('int8_loops', [dict()]):
-        for k in loop.keys():
-            extra.add(k)
-    def skip_if(k):
-        if 'template' in k:
-            return True
-        if k in {'build_env'}:
-            return True
-    return set(k for k in extra if not skip_if(k))
-
 def main():
     init_logger()
     
@@ -475,16 +400,8 @@ def main():
     tree = BuildTree(os.path.abspath('.'), args)
     stat_fn = os.path.join(tree.global_config['outdir'], 'stats.csv')
     launch_time_fn = os.path.join(tree.global_config['outdir'], 'launch_time.csv')
-    extra = set(['prec'])
-    if args.mlir:
-        run_func = run_mlir
-    else:
-        run_func = run_nntc
-        for path, config in tree.walk():
-            for k in collect_nntc_headers(tree, config):
-                extra.add(k)
-    extra = list(extra)
-    extra.sort()
+    run_func = run_mlir if args.mlir else run_nntc
+    extra = collect_extra_headers(tree, args.mlir)
     ok = True
     succ_cases, failed_cases = [], []
     with open(stat_fn, 'w') as f:
@@ -529,23 +446,19 @@ def main():
                 'core1_time',
                 'core2_time',
                 'cpu_time'])
-        for path, config in tree.walk():
-            if config['model_name'] and config['name'] != config['model_name']:
-                continue
+        for path, config in walk_run_configs(tree):
             if 'parallel' not in config.keys():
                 config['parallel'] = False
             if args.parallel:
                 config['parallel'] = True
-            for i in range(len(config['core_list'])):
-                config['num_core'] = config['core_list'][i]
-                res = run_func(tree, path, config, csv_f, csv_l, extra, cache=args.use_cache)
-                if args.mlir:
-                    succ_cases.extend(res[0])
-                    failed_cases.extend(res[1])
-                    ok = all(res[0]) and ok
-                else:
-                    succ_cases.append(config['name']) if res[0] else failed_cases.append(config['name'])
-                    ok = res[0] and ok
+            res = run_func(tree, path, config, csv_f, csv_l, extra, cache=args.use_cache)
+            if args.mlir:
+                succ_cases.extend(res[0])
+                failed_cases.extend(res[1])
+                ok = all(res[0]) and ok
+            else:
+                succ_cases.append(config['name']) if res[0] else failed_cases.append(config['name'])
+                ok = res[0] and ok
 
         if f_l:
             f_l.close()
@@ -18,6 +18,32 @@ def sys_memory_size():
            raise RuntimeError
        return int(m.group(1))
 
+def reset_peak_rss():
+    """
+    Reset the peak resident size of this process, where the kernel
+    supports it, so peak_rss covers what follows.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+def peak_rss():
+    """
+    Peak resident size of this process in kB.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                m = re.match('^VmHWM:\s+(\d+) kB', line)
+                if m:
+                    return int(m.group(1))
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
 def env_list_to_dict(env, base=os.environ):
     env_dict = base.copy()
     for v in env:
@@ -1,4 +1,6 @@
+import re
 import logging
+import argparse
 import importlib
 import os
 
@@ -47,3 +49,114 @@ def format_seconds(s):
         ['hours', 'minutes', 'seconds'])
     ret = ' '.join(f'{v} {u}' for v, u in pairs if v) or '0 second'
     return f'{days} days {ret}' if days else ret
+
+def mlir_deploy_parser():
+    parser = argparse.ArgumentParser(description='MLIR deploy')
+    parser.add_argument(
+        "--quantize", default="F32",
+        type=str.upper, choices=['F32', 'BF16', 'F16', 'INT8', 'QDQ'],
+        help="set default qauntization type: F32/BF16/F16/INT8")
+    parser.add_argument(
+        "--chip", required=True, type=str.lower,
+        choices=['bm1688', 'bm1684x', 'bm1684',
+            'cv186x', 'cv183x', 'cv182x', 'cv181x', 'cv180x'],
+        help="chip platform name")
+    parser.add_argument("--model", required=True, help='output model')
+    parser.add_argument(
+        "--asymmetric", action='store_true',
+        help="do INT8 asymmetric quantization")
+    return parser
+
+def iter_mlir_bmodels(tree, raw_config):
+    """
+    Yields (title, args, name, bmodel) of each deploy of a mlir model,
+    args being the parsed deploy options and name the precision.
+    """
+    parser = mlir_deploy_parser()
+    for i, deploy in enumerate(raw_config.get('deploy', [])):
+        title = f'mlir_deploy_core{raw_config["num_core"]}.{i}'
+        deploy = tree.expand_variables(raw_config, deploy)
+        args, _ = parser.parse_known_args(deploy.split())
+        bmodel = args.model.replace('.bmodel', '/compilation.bmodel')
+        if not os.path.exists(bmodel):
+            bmodel = args.model
+        name = args.quantize
+        if re.match(r'^F\d+$', name):
+            name = name.replace('F', 'FP')
+        if args.asymmetric:
+            name += '-asym'
+        yield title, args, name, bmodel
+
+def iter_nntc_bmodels(tree, raw_config):
+    """
+    Yields (config, name, batch, bmodel) of the fp and int8 bmodels of a
+    nntc model, config being raw_config with a loop of fp_loops or
+    int8_loops applied.
+    """
+    workdir = raw_config['workdir']
+    fp_loops = raw_config.get('fp_loops') or \
+        tree.global_config.get('fp_loops') or [dict()]
+    for loop in fp_loops:
+        if 'fp_compile_options' not in raw_config:
+            # Skip fp bmrt test
+            break
+        config = dict_override(raw_config, loop)
+        if 'prec' not in config:
+            config['prec'] = 'FP32'
+        batch_sizes = config.get('fp_batch_sizes', [1])
+        for b in batch_sizes:
+            name = config.get('fp_outdir_template', '{}b.fp.compilation').format(b)
+            yield config, name, b, os.path.join(workdir, name, 'compilation.bmodel')
+
+    int8_loops = raw_config.get('int8_loops') or \
+        tree.global_config.get('int8_loops') or [dict()]
+    for loop in int8_loops:
+        if 'bmnetu_options' not in raw_config:
+            # Skip bmrt test
+            break
+        config = dict_override(raw_config, loop)
+        if 'prec' not in config:
+            config['prec'] = 'INT8'
+        for b in config['bmnetu_batch_sizes']:
+            name = config.get('int8_outdir_template', '{}b.compilation').format(b)
+            yield config, name, b, os.path.join(workdir, name, 'compilation.bmodel')
+
+def collect_nntc_headers(tree, config):
+    extra = set()
+    for loop in config.get('fp_loops', [dict()]):
+        for k in loop.keys():
+            extra.add(k)
+    for loop in config.get('int8_loops', [dict()]):
+        for k in loop.keys():
+            extra.add(k)
+    def skip_if(k):
+        if 'template' in k:
+            return True
+        if k in {'build_env'}:
+            return True
+    return set(k for k in extra if not skip_if(k))
+
+def walk_run_configs(tree):
+    """
+    Yields (path, config) of each model config to run, once per core
+    count of core_list with num_core set.
+    """
+    for path, config in tree.walk():
+        if config['model_name'] and config['name'] != config['model_name']:
+            continue
+        for num_core in config['core_list']:
+            config['num_core'] = num_core
+            yield path, config
+
+def collect_extra_headers(tree, mlir=False):
+    """
+    Returns sorted config keys which stats.csv has a column of.
+    """
+    extra = set(['prec'])
+    if not mlir:
+        for path, config in tree.walk():
+            for k in collect_nntc_headers(tree, config):
+                extra.add(k)
+    extra = list(extra)
+    extra.sort()
+    return extra